@@ -0,0 +1,196 @@
+"""
+Command line engine applying the same CSS edits to many EPUB files,
+without starting the graphical interface.\n
+Example:\n
+python batch.py "books/**/*.epub" -o restyled --set p color #333333
+--remove h1 font-weight --embed-font body fonts/Signika/static/Signika-Regular.ttf
+"""
+import argparse
+import contextlib
+import glob
+import io
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import freeze_support
+from pathlib import Path
+
+from file_manager import FileManager
+from font import Font
+
+EDIT_SET = 'set'
+EDIT_REMOVE = 'remove'
+EDIT_EMBED_FONT = 'embed-font'
+
+
+class BatchError(Exception):
+    pass
+
+
+class AppendEdit(argparse.Action):
+    """
+    Appends (kind of the edit given in `const`, *values) to the edits,
+    so that edits of all kinds keep the order of the command line
+    """
+    def __call__(self, parser, namespace, values, option_string=None):
+        edits = list(getattr(namespace, self.dest) or [])
+        edits.append((self.const, *values))
+        setattr(namespace, self.dest, edits)
+
+
+def apply_edit(file_manager: FileManager, edit: tuple) -> None:
+    kind, style_name, *values = edit
+    if file_manager.get_css_style_by_name(style_name) is None:
+        raise BatchError(f'Style "{style_name}" not found')
+
+    if kind == EDIT_SET:
+        file_manager.set_css_param(style_name, *values)
+    elif kind == EDIT_REMOVE:
+        file_manager.remove_css_param(style_name, *values)
+    elif kind == EDIT_EMBED_FONT:
+        font = Font(str(values[0]), file_type=Font.TYPE_LOCAL_FILE)
+        if font.file_type != Font.TYPE_LOCAL_FILE:
+            raise BatchError(f'"{values[0]}" is not a .ttf file')
+        file_manager.set_css_param(style_name, 'font-family',
+                                   font.get_css_string())
+        file_manager.add_font_to_epub(font)
+    else:
+        raise BatchError(f'Unknown edit "{kind}"')
+
+
+def restyle_book(book_path: str, output_path: str, edits: list[tuple],
+                 cache_dir: str = None) -> tuple[str, str]:
+    """
+    Applies `edits` to the book and saves it under `output_path`.
+    Parsed stylesheets are cached in `cache_dir`, by default the one
+    of the editor.
+    Returns tuple: (path of the book, error message or `None`)
+    """
+    log = io.StringIO()
+    try:
+        with tempfile.TemporaryDirectory() as edition_dir,\
+                contextlib.redirect_stdout(log):
+            file_manager = FileManager(edition_dir, cache_dir)
+            # Books are already processed in parallel
+            file_manager.min_parallel_parsing_size = sys.maxsize
+            file_manager.save_workers = 1
+            try:
+                if file_manager.load_book(book_path) > 0:
+                    raise BatchError('Not a valid EPUB')
+                for edit in edits:
+                    apply_edit(file_manager, edit)
+                os.makedirs(Path(output_path).parent, exist_ok=True)
+                if file_manager.save_book(output_path) > 0:
+                    raise BatchError('Could not save the book')
+            finally:
+                # Edition directory can not be removed while book is open
+                file_manager.container.close()
+    except Exception as e:
+        details = log.getvalue().strip().replace('\n', '; ')
+        if details:
+            return book_path, f'{e} ({details})'
+        return book_path, str(e)
+    return book_path, None
+
+
+def find_books(patterns: list[str]) -> list[Path]:
+    books = []
+    for pattern in patterns:
+        matches = glob.glob(pattern, recursive=True)
+        if len(matches) == 0 and Path(pattern).is_file():
+            matches = [pattern]
+        books.extend(Path(match) for match in sorted(matches)
+                     if match.lower().endswith('.epub'))
+    return list(dict.fromkeys(books))  # Removes duplicates, keeps order
+
+
+def get_output_path(book_path: Path, output_dir: Path,
+                    base_dir: Path) -> Path:
+    try:
+        relative_path = book_path.resolve().relative_to(base_dir)
+    except ValueError:
+        relative_path = Path(book_path.name)
+    return output_dir / relative_path
+
+
+def restyle_books(books: list[Path], output_dir: Path, edits: list[tuple],
+                  workers: int = None) -> list[tuple[str, str]]:
+    """
+    Restyles books across a process pool, printing failures as they occur.
+    Returns list of (path of the book, error message) for failed books
+    """
+    output_dir = Path(output_dir).resolve()
+    base_dir = Path(os.path.commonpath([book.resolve().parent
+                                        for book in books]))
+    failures = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(restyle_book, str(book),
+                                   str(get_output_path(book, output_dir,
+                                                       base_dir)),
+                                   edits)
+                   for book in books]
+        for future in as_completed(futures):
+            book_path, error = future.result()
+            if error is not None:
+                print(f'FAILED {book_path}: {error}', file=sys.stderr)
+                failures.append((book_path, error))
+    return failures
+
+
+def parse_arguments(argv: list[str] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description='Apply CSS edits to many EPUB files in parallel')
+    parser.add_argument('books', nargs='+',
+                        help='paths or glob patterns ("**" is recursive)')
+    parser.add_argument('-o', '--output-dir', required=True, type=Path,
+                        help='directory for restyled books')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='number of worker processes (default: cores)')
+    parser.add_argument('--set', nargs=3, action=AppendEdit, const=EDIT_SET,
+                        dest='edits', default=[],
+                        metavar=('STYLE', 'PROPERTY', 'VALUE'),
+                        help='set property of a style')
+    parser.add_argument('--remove', nargs=2, action=AppendEdit,
+                        const=EDIT_REMOVE, dest='edits',
+                        metavar=('STYLE', 'PROPERTY'),
+                        help='remove property from a style')
+    parser.add_argument('--embed-font', nargs=2, action=AppendEdit,
+                        const=EDIT_EMBED_FONT, dest='edits',
+                        metavar=('STYLE', 'TTF_FILE'),
+                        help='embed a font and use it in a style')
+    return parser.parse_args(argv)
+
+
+def main(argv: list[str] = None) -> int:
+    arguments = parse_arguments(argv)
+    # Edits are applied in the order they were given
+    edits = [(kind, style, str(Path(values[0]).resolve()))
+             if kind == EDIT_EMBED_FONT else (kind, style, *values)
+             for kind, style, *values in arguments.edits]
+    if len(edits) == 0:
+        print('No edits given', file=sys.stderr)
+        return 2
+
+    books = find_books(arguments.books)
+    if len(books) == 0:
+        print('No books found', file=sys.stderr)
+        return 2
+
+    start = time.perf_counter()
+    failures = restyle_books(books, arguments.output_dir, edits,
+                             arguments.jobs)
+    elapsed = time.perf_counter() - start
+
+    succeeded = len(books) - len(failures)
+    size = sum(book.stat().st_size for book in books) / (1024 * 1024)
+    print(f'Restyled {succeeded} of {len(books)} books in {elapsed:.1f} s '
+          f'({len(books) / elapsed * 3600:.0f} books/h, '
+          f'{size / elapsed:.1f} MB/s), {len(failures)} failed')
+    return 1 if len(failures) > 0 else 0
+
+
+if __name__ == '__main__':
+    freeze_support()
+    sys.exit(main())
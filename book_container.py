@@ -0,0 +1,419 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from copy import copy
+from os import cpu_count, makedirs, remove, replace, SEEK_CUR
+from pathlib import Path, PurePosixPath
+from shutil import copymode
+from urllib.parse import unquote
+from uuid import uuid4
+from zipfile import ZIP_DEFLATED, ZIP_STORED, ZIP64_LIMIT, ZipFile, ZipInfo
+import struct
+import time
+import zlib
+
+# Bit of general purpose flag set when sizes follow the compressed data
+DATA_DESCRIPTOR_FLAG = 0x08
+LOCAL_HEADER_SIZE = 30
+COPY_CHUNK_SIZE = 1024 * 1024
+# Has to be the first, uncompressed member of every .epub file
+MIMETYPE_NAME = 'mimetype'
+
+
+class BookContainer:
+    """
+    Virtual view of the files of an opened .epub package.\n
+    Members are read lazily from the archive. Only members that were
+    written (edited) are present in the edition directory. Without an opened archive every member is read from the
+    edition directory, which allows to work on unpacked books
+    """
+    def __init__(self, edition_dir: str) -> None:
+        self.edition_dir = Path(edition_dir)
+        self.source_path = None
+        self._archive = None
+        self._members = dict[str, ZipInfo]()
+        self._modified = set[str]()
+        self._removed = set[str]()
+        # Member name -> number of the write that last changed it
+        self._versions = dict[str, int]()
+        self._write_count = 0
+
+    def open(self, file_path: str) -> None:
+        """
+        Opens archive from `file_path`, only its central directory is read.
+        Raises the same exceptions as `zipfile.ZipFile`
+        """
+        self.close()
+        archive = ZipFile(file_path)
+        self._archive = archive
+        self.source_path = Path(file_path)
+        self._members = {info.filename: info for info in archive.infolist()
+                         if not info.is_dir()}
+
+    def close(self) -> None:
+        if self._archive is not None:
+            self._archive.close()
+        self._archive = None
+        self.source_path = None
+        self._members.clear()
+        self._modified.clear()
+        self._removed.clear()
+        self._versions.clear()
+
+    def is_open(self) -> bool:
+        return self._archive is not None
+
+    def member_name(self, path: str) -> str:
+        """
+        Returns name under which file from `path` is stored in the package.
+        `path` can be either absolute path inside of the edition directory
+        or path relative to root of the package
+        """
+        path = Path(path)
+        if path.is_absolute():
+            path = path.relative_to(self.edition_dir)
+        return path.as_posix()
+
+    def get_path(self, name: str) -> Path:
+        return self.edition_dir / self.member_name(name)
+
+    def names(self) -> list[str]:
+        """
+        Returns names of all members of the package, members of the source
+        archive first, in their original order
+        """
+        names = [name for name in self._members if name not in self._removed]
+        names.extend(sorted(name for name in self._modified
+                            if name not in self._members))
+        return names
+
+    def exists(self, name: str) -> bool:
+        name = self.member_name(name)
+        if name in self._removed:
+            return False
+        if name in self._members or name in self._modified:
+            return True
+        return not self.is_open() and self.get_path(name).is_file()
+
+    def is_modified(self, name: str) -> bool:
+        return self.member_name(name) in self._modified
+
+    def read(self, name: str) -> bytes:
+        name = self.member_name(name)
+        if name in self._removed:
+            raise FileNotFoundError(f'"{name}" has been removed from the book')
+        if name in self._members and name not in self._modified:
+            return self._archive.read(self._members[name])
+        with open(self.get_path(name), 'rb') as file:
+            return file.read()
+
+    def get_size(self, name: str) -> int:
+        """
+        Returns uncompressed size of the member in bytes
+        """
+        name = self.member_name(name)
+        if name in self._removed:
+            raise FileNotFoundError(f'"{name}" has been removed from the book')
+        if name in self._members and name not in self._modified:
+            return self._members[name].file_size
+        return self.get_path(name).stat().st_size
+
+    def write(self, name: str, data: bytes) -> None:
+        """
+        Writes `data` into the edition directory and marks member as modified
+        """
+        name = self.member_name(name)
+        path = self.get_path(name)
+        makedirs(path.parent, exist_ok=True)
+        with open(path, 'wb') as file:
+            file.write(data)
+        self._removed.discard(name)
+        self._modified.add(name)
+        self._write_count += 1
+        self._versions[name] = self._write_count
+
+    def remove(self, name: str) -> None:
+        name = self.member_name(name)
+        if name in self._members:
+            self._removed.add(name)
+        self._modified.discard(name)
+        path = self.get_path(name)
+        if path.is_file():
+            remove(path)
+
+    def save(self, file_path: str, media_types: dict[str, str] = None,
+             policy=None, workers: int = None, progress=None) -> None:
+        """
+        Writes all members of the package into a new archive, see
+        `SaveSnapshot.write`. The archive is written into a temporary file,
+        which then replaces the file at `file_path`
+        """
+        snapshot = self.snapshot(media_types, policy, workers)
+        temp_path = snapshot.write(file_path, progress)
+        self.finish_save(snapshot, temp_path, file_path)
+
+    def snapshot(self, media_types: dict[str, str] = None, policy=None,
+                 workers: int = None) -> 'SaveSnapshot':
+        """
+        Returns state of the package to be saved, independent of later
+        changes. Data of modified members is copied into memory
+        """
+        members = []
+        for name in self._get_save_order():
+            if name in self._members and name not in self._modified:
+                members.append((name, self._members[name], None))
+            else:
+                members.append((name, None, self.read(name)))
+        versions = {name: self._versions[name] for name in self._modified}
+        return SaveSnapshot(self.source_path, members, versions,
+                            set(self._removed), media_types, policy, workers)
+
+    def finish_save(self, snapshot: 'SaveSnapshot', temp_path: str,
+                    file_path: str) -> None:
+        """
+        Moves archive written by `snapshot` into place. If it replaces the
+        source archive, the source is reopened. If it can not be moved,
+        the temporary file is removed
+        """
+        save_path = Path(file_path).resolve()
+        overwrites_source = self.source_path is not None and\
+            snapshot.source_path is not None and\
+            save_path == self.source_path.resolve() and\
+            save_path == snapshot.source_path.resolve()
+        if overwrites_source:
+            # Opened file can not be replaced on some systems
+            self._archive.close()
+        try:
+            replace(temp_path, save_path)
+        except OSError:
+            if overwrites_source:
+                self._archive = ZipFile(self.source_path)
+            if Path(temp_path).is_file():
+                remove(temp_path)
+            raise
+        if overwrites_source:
+            self._reopen(save_path, snapshot)
+
+    def _get_save_order(self) -> list[str]:
+        names = self.names()
+        if MIMETYPE_NAME in names:
+            names.remove(MIMETYPE_NAME)
+            names.insert(0, MIMETYPE_NAME)
+        return names
+
+    def _reopen(self, file_path: Path, snapshot: 'SaveSnapshot') -> None:
+        # Members changed after the snapshot differ from the new archive
+        modified = {name for name in self._modified
+                    if self._versions[name] != snapshot.versions.get(name)}
+        removed = self._removed - snapshot.removed
+        # Other edited members are read from the new archive
+        self._archive = ZipFile(file_path)
+        self.source_path = file_path
+        self._members = {info.filename: info
+                         for info in self._archive.infolist()
+                         if not info.is_dir()}
+        self._modified = modified
+        self._removed = removed & set(self._members)
+
+
+class SaveSnapshot:
+    """
+    Members of the package at the moment saving started, members from the
+    source archive are referenced by their `ZipInfo`, others are kept in
+    memory. Can be written from any thread
+    """
+    def __init__(self, source_path: Path,
+                 members: list[tuple[str, ZipInfo, bytes]],
+                 versions: dict[str, int], removed: set[str],
+                 media_types: dict[str, str] = None, policy=None,
+                 workers: int = None) -> None:
+        self.source_path = source_path
+        self.members = members
+        self.versions = versions
+        self.removed = removed
+        self.media_types = media_types or {}
+        self.policy = policy
+        self.workers = workers or cpu_count() or 1
+
+    def get_total_size(self) -> int:
+        return sum(len(data) if info is None else info.file_size
+                   for _, info, data in self.members)
+
+    def write(self, file_path: str, progress=None) -> Path:
+        """
+        Writes the archive into a temporary file in the directory of
+        `file_path` and returns path to it.\n
+        Members are compressed as `policy` (a `CompressionPolicy`) decides
+        for their media type from `media_types`, all of them are deflated
+        if no policy is given. Members that were not modified and are
+        compressed the same way are copied from the source archive as they
+        are, without decompressing and compressing them again.\n
+        Other members are compressed in memory by `workers` threads
+        (one per core by default) and written in the same order as always.
+        `progress` is called after every member with: bytes written,
+        bytes total, members written, members total
+        """
+        save_path = Path(file_path).resolve()
+        temp_path = save_path.with_name(f'.{save_path.name}.{uuid4().hex}.tmp')
+        try:
+            self._write(temp_path, progress)
+            if save_path.is_file():
+                copymode(save_path, temp_path)
+        except BaseException:
+            if temp_path.is_file():
+                remove(temp_path)
+            raise
+        return temp_path
+
+    def _write(self, temp_path: str, progress) -> None:
+        source = None
+        source_archive = None
+        if self.source_path is not None:
+            source = open(self.source_path, 'rb')
+            source_archive = ZipFile(self.source_path)
+        bytes_total = self.get_total_size()
+        done = [0, 0]
+
+        def write_pending(book, name, info, compressed):
+            if compressed is None:
+                copy_raw_member(source, book, info)
+            else:
+                info, data = compressed.result()
+                write_raw_member(book, info, [data])
+            done[0] += info.file_size
+            done[1] += 1
+            if progress is not None:
+                progress(done[0], bytes_total, done[1], len(self.members))
+
+        try:
+            with ZipFile(temp_path, 'x', ZIP_DEFLATED) as book,\
+                    ThreadPoolExecutor(max_workers=self.workers) as executor:
+                # Members waiting to be written, in order, so that the
+                # number of compressed buffers kept in memory is limited
+                pending = deque()
+                for name, info, data in self.members:
+                    compress_type, level = self._get_compression(name)
+                    if self._can_copy_raw(name, info, compress_type):
+                        pending.append((name, info, None))
+                        continue
+                    pending.append((name, info, executor.submit(
+                        self._compress_member, source_archive, name, info,
+                        data, compress_type, level)))
+                    while len(pending) > self.workers * 4:
+                        write_pending(book, *pending.popleft())
+                while len(pending) > 0:
+                    write_pending(book, *pending.popleft())
+        finally:
+            if source is not None:
+                source.close()
+                source_archive.close()
+
+    @staticmethod
+    def _compress_member(source_archive: ZipFile, name: str, info: ZipInfo,
+                         data: bytes, compress_type: int, level: int)\
+            -> tuple[ZipInfo, bytes]:
+        if data is None:
+            data = source_archive.read(info)
+        return compress_member(name, data, compress_type, level)
+
+    def _get_compression(self, name: str) -> tuple[int, int]:
+        if name == MIMETYPE_NAME:
+            return ZIP_STORED, None
+        if self.policy is None:
+            return ZIP_DEFLATED, None
+        return self.policy.get_compression(name, self.media_types.get(name))
+
+    @staticmethod
+    def _can_copy_raw(name: str, info: ZipInfo, compress_type: int) -> bool:
+        # Copied header of "mimetype" could contain an extra field
+        if info is None or name == MIMETYPE_NAME:
+            return False
+        return info.compress_type == compress_type and\
+            info.file_size < ZIP64_LIMIT and info.compress_size < ZIP64_LIMIT
+
+
+def copy_raw_member(source, book: ZipFile, info: ZipInfo) -> None:
+    """
+    Appends member described by `info` from opened archive file `source`
+    to `book`, copying its compressed data byte for byte
+    """
+    source.seek(info.header_offset)
+    header = source.read(LOCAL_HEADER_SIZE)
+    name_length, extra_length = struct.unpack('<HH', header[26:30])
+    source.seek(name_length + extra_length, SEEK_CUR)
+
+    remaining = info.compress_size
+
+    def chunks():
+        nonlocal remaining
+        while remaining > 0:
+            chunk = source.read(min(remaining, COPY_CHUNK_SIZE))
+            if len(chunk) == 0:
+                raise EOFError(f'"{info.filename}" is truncated')
+            remaining -= len(chunk)
+            yield chunk
+
+    new_info = copy(info)
+    # Sizes are known up front, so they are stored in the local header
+    new_info.flag_bits &= ~DATA_DESCRIPTOR_FLAG
+    write_raw_member(book, new_info, chunks())
+
+
+def compress_member(name: str, data: bytes, compress_type: int,
+                    level: int = None) -> tuple[ZipInfo, bytes]:
+    """
+    Compresses `data` in memory, returns `ZipInfo` for the member and its
+    compressed data, ready for `write_raw_member`
+    """
+    info = ZipInfo(name, date_time=time.localtime(time.time())[:6])
+    info.compress_type = compress_type
+    info.external_attr = 0o600 << 16  # permissions: ?rw-------
+    info.file_size = len(data)
+    info.CRC = zlib.crc32(data)
+    if compress_type == ZIP_DEFLATED:
+        if level is None:
+            level = zlib.Z_DEFAULT_COMPRESSION
+        # Negative window bits give raw deflate stream, as used by zip
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+        data = compressor.compress(data) + compressor.flush()
+    elif compress_type != ZIP_STORED:
+        raise NotImplementedError('Only stored and deflated members \
+can be compressed in memory')
+    info.compress_size = len(data)
+    return info, data
+
+
+def write_raw_member(book: ZipFile, info: ZipInfo, chunks) -> None:
+    """
+    Appends already compressed data to `book`. `info` has to have its CRC,
+    sizes and compression type set
+    """
+    if book.fp.seekable():
+        book.fp.seek(book.start_dir)
+    info.header_offset = book.fp.tell()
+    book._writecheck(info)
+    book._didModify = True
+    book.fp.write(info.FileHeader())
+    for chunk in chunks:
+        book.fp.write(chunk)
+    book.filelist.append(info)
+    book.NameToInfo[info.filename] = info
+    book.start_dir = book.fp.tell()
+
+
+def resolve_href(base_name: str, href: str) -> str:
+    """
+    Returns name of a member referenced with `href` from member `base_name`,
+    or `None` if `href` does not point inside of the package
+    """
+    href = unquote(href.split('#', 1)[0].split('?', 1)[0])
+    if href == '' or ':' in href.split('/', 1)[0] or href.startswith('/'):
+        return None
+    parts = []
+    for part in (PurePosixPath(base_name).parent / href).parts:
+        if part == '..':
+            if len(parts) == 0:
+                return None
+            parts.pop()
+        elif part != '.':
+            parts.append(part)
+    return '/'.join(parts)
@@ -0,0 +1,35 @@
+from mimetypes import guess_type
+from zipfile import ZIP_DEFLATED, ZIP_STORED
+
+from pathfinder import COMPRESSED_MEDIA_TYPES
+
+DEFAULT_COMPRESS_LEVEL = 6
+
+
+class CompressionPolicy:
+    """
+    Decides how members of the package are compressed on save, based on
+    their media type.\n
+    Members of `stored_media_types` are stored uncompressed, the rest is
+    deflated with level from `levels` or with `default_level`
+    """
+    def __init__(self, stored_media_types: list[str] = None,
+                 levels: dict[str, int] = None,
+                 default_level: int = DEFAULT_COMPRESS_LEVEL) -> None:
+        if stored_media_types is None:
+            stored_media_types = COMPRESSED_MEDIA_TYPES
+        self.stored_media_types = set(stored_media_types)
+        self.levels = dict(levels or {})
+        self.default_level = default_level
+
+    def get_compression(self, name: str, media_type: str = None)\
+            -> tuple[int, int]:
+        """
+        Returns tuple: (compression type, compression level) for a member.
+        If `media_type` is not known, it is guessed from the file extension
+        """
+        if media_type is None:
+            media_type = guess_type(name)[0]
+        if media_type in self.stored_media_types:
+            return ZIP_STORED, None
+        return ZIP_DEFLATED, self.levels.get(media_type, self.default_level)
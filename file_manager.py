@@ -1,28 +1,53 @@
-from os import listdir, mkdir, makedirs, unlink, walk, sep, remove
+from os import listdir, mkdir, unlink, sep
 from os.path import relpath
+import mimetypes
 from pathlib import Path
 import zipfile
-from zipfile import ZIP_DEFLATED, ZipFile
-from shutil import rmtree, copyfile
+from shutil import rmtree
 
 from cssutils.css import CSSStyleDeclaration, CSSFontFaceRule
-from gui_elements import *
-
 import cssutils
 
+from book_container import BookContainer
+from compression_policy import CompressionPolicy
+from font import Font
 from pathfinder import Pathfinder
+from selector_index import SelectorIndex
+from stylesheet_loader import PARALLEL_PARSING_MIN_SIZE, StylesheetCache, parse_stylesheets
 
 
 class FileManager:
     FONT_MEDIA_TYPE = "application/x-font-ttf"
 
-    def __init__(self):
+    def __init__(self, edition_dir=None, cache_dir=None):
         self.load_path = None
         self.css_files = []
         self.css_file_paths = []
+        self.dirty_css_files = set()
+        # Set when rules are added or removed, changed declarations
+        # can be shown without reloading the page
+        self.css_rules_changed = False
+        # Selector text -> list of (index of CSS file, rule), in order of
+        # appearance. Duplicated selectors have more than one entry
+        self.style_index = {}
+        # Font family -> list of (index of CSS file, @font-face rule)
+        self.font_face_index = {}
+        # Font family -> number of style rules using it as the first family
+        self.font_usage = {}
         self.page_files_paths = []
+        # Pages on which styles are used, built after the book is loaded
+        self.selector_index = None
         self.edition_dir = Path(__file__).parent / 'edit'
-        self.pathfinder = Pathfinder(self.edition_dir)
+        if edition_dir is not None:
+            self.edition_dir = Path(edition_dir)
+        self.container = BookContainer(self.edition_dir)
+        self.pathfinder = Pathfinder(self.edition_dir, self.container)
+        if cache_dir is None:
+            cache_dir = Path(__file__).parent / 'cache' / 'stylesheets'
+        self.stylesheet_cache = StylesheetCache(cache_dir)
+        self.min_parallel_parsing_size = PARALLEL_PARSING_MIN_SIZE
+        self.compression_policy = CompressionPolicy()
+        self.save_workers = None  # One thread per core
         self.prepare_edition_dir()
 
     def prepare_edition_dir(self):
@@ -42,16 +67,47 @@ class FileManager:
 
     def load_book(self, file_path):
         """
-        Unpacks a zip from specified path into the editing directory.
+        Opens a zip from specified path and parses its stylesheets.
         Returns 0 if succeeded, or a positive number otherwise
         """
-        self.load_path = Path(file_path)
+        self.close_book()
+        result = self.open_book(file_path)
+        if result > 0:
+            return result
+
+        self.load_css_files()
+
+        print('File loaded')
+        return 0
+
+    def close_book(self):
+        """
+        Closes the book and clears the edition directory. It is called
+        by the thread which shows the book, before open_book() runs,
+        which may be in another thread
+        """
+        self.load_path = None
+        self.css_files = []
+        self.css_file_paths = []
+        self.page_files_paths = []
+        self.css_rules_changed = False
+        self.selector_index = None
+        self.build_css_indexes()
+        self.container.close()
         self.prepare_edition_dir()
 
+    def open_book(self, file_path):
+        """
+        Opens a zip from specified path, its members are read on demand.
+        Only structure of the book is read, so that pages can be shown,
+        stylesheets have to be parsed with load_css_files() afterwards.
+        The previous book has to be closed with close_book().
+        Returns 0 if succeeded, or a positive number otherwise
+        """
+        self.load_path = Path(file_path)
+
         try:
-            book = ZipFile(self.load_path)
-            book.extractall(self.edition_dir)
-            book.close()
+            self.container.open(self.load_path)
         except PermissionError as e:
             print(f"Could not open file due to {e}")
             self.load_path = None
@@ -75,22 +131,109 @@ class FileManager:
         self.page_files_paths, self.css_file_paths = \
             self.pathfinder.get_rendition_paths()
 
-        self.load_css_files()
-
-        print('File loaded')
         return 0
 
     def load_css_files(self):
-        self.css_files = []
-        for css_path in self.css_file_paths:
-            self.css_files.append(cssutils.parseFile(css_path))
+        self.dirty_css_files.clear()
+        sources = [(self.container.read(css_path), css_path.as_uri())
+                   for css_path in self.css_file_paths]
+        self.css_files = parse_stylesheets(sources, self.min_parallel_parsing_size, self.stylesheet_cache)
+        self.build_css_indexes()
+
+    def reload_css_file(self, file_index):
+        css_path = self.css_file_paths[file_index]
+        self.unindex_css_file(file_index)
+        self.css_files[file_index] = parse_stylesheets(
+            [(self.container.read(css_path), css_path.as_uri())], cache=self.stylesheet_cache)[0]
+        self.dirty_css_files.discard(file_index)
+        self.index_css_file(file_index, keep_order=True)
+
+    def build_css_indexes(self):
+        self.style_index = {}
+        self.font_face_index = {}
+        self.font_usage = {}
+        for file_index in range(self.get_css_file_count()):
+            self.index_css_file(file_index)
+
+    def index_css_file(self, file_index, keep_order=False):
+        """
+        Adds rules of the file to the indexes. With `keep_order` entries are
+        also sorted, needed if files after this one are indexed already
+        """
+        for rule in self.css_files[file_index].cssRules:
+            if rule.type == cssutils.css.CSSRule.STYLE_RULE:
+                self.count_font_usage(self.get_rule_font_family(rule), 1)
+                rules = self.style_index.setdefault(rule.selectorText, [])
+            elif rule.type == cssutils.css.CSSRule.FONT_FACE_RULE and \
+                    self.get_font_face_family(rule) is not None:
+                rules = self.font_face_index.setdefault(self.get_font_face_family(rule), [])
+            else:
+                continue
+            rules.append((file_index, rule))
+            if keep_order:
+                # Stable sort, order of rules inside of the file stays
+                rules.sort(key=lambda entry: entry[0])
+
+    def unindex_css_file(self, file_index):
+        for rule in self.css_files[file_index].cssRules:
+            if rule.type == cssutils.css.CSSRule.STYLE_RULE:
+                self.count_font_usage(self.get_rule_font_family(rule), -1)
+                index, key = self.style_index, rule.selectorText
+            elif rule.type == cssutils.css.CSSRule.FONT_FACE_RULE:
+                index, key = self.font_face_index, self.get_font_face_family(rule)
+            else:
+                continue
+            if key not in index:
+                continue
+            index[key] = [entry for entry in index[key] if entry[0] != file_index]
+            if len(index[key]) == 0:
+                del index[key]
+
+    def index_font_face_rule(self, file_index, rule):
+        font_family = self.get_font_face_family(rule)
+        if font_family is not None:
+            self.font_face_index.setdefault(font_family, []).append((file_index, rule))
+
+    @staticmethod
+    def get_font_face_family(rule):
+        props = rule.style.getProperties('font-family')
+        if len(props) < 1:
+            return None
+        return Font.unquote_family(props[0].propertyValue.cssText)
+
+    # Returns the first font family of the style rule, or None
+    @staticmethod
+    def get_rule_font_family(rule):
+        props = rule.style.getProperties('font-family')
+        if len(props) < 1:
+            return None
+        return Font.unquote_family(props[0].propertyValue.cssText.split(',', 1)[0])
+
+    def count_font_usage(self, font_family, change):
+        if font_family is None:
+            return
+        count = self.font_usage.get(font_family, 0) + change
+        if count > 0:
+            self.font_usage[font_family] = count
+        else:
+            self.font_usage.pop(font_family, None)
 
     # Saves changes by overwriting edited css files
+    # Returns paths of the files that have been written
     def update_css(self):
-        for i in range(self.get_css_file_count()):
-            css_file = open(self.css_file_paths[i], "wb")
-            css_file.write(self.css_files[i].cssText)
-            css_file.close()
+        changed_paths = []
+        for i in sorted(self.dirty_css_files):
+            self.container.write(self.css_file_paths[i],
+                                 self.css_files[i].cssText)
+            changed_paths.append(self.css_file_paths[i])
+        self.dirty_css_files.clear()
+        return changed_paths
+
+    def mark_css_file_dirty(self, file_index):
+        self.dirty_css_files.add(file_index)
+
+    def is_css_file_dirty(self, file_index):
+        return file_index in self.dirty_css_files
 
     def is_file_loaded(self):
         return self.load_path is not None
@@ -103,16 +246,24 @@ class FileManager:
         return style.getPropertyValue(param_name)
 
     def set_css_param(self, style_name, param_name, value):
-        style = self.get_css_style_by_name(style_name)
-        if style is None:
+        file_index, rule = self.get_css_rule_by_name(style_name)
+        if rule is None:
             return
-        style.setProperty(param_name, value)
+        if param_name == 'font-family':
+            self.count_font_usage(self.get_rule_font_family(rule), -1)
+        rule.style.setProperty(param_name, value)
+        if param_name == 'font-family':
+            self.count_font_usage(self.get_rule_font_family(rule), 1)
+        self.mark_css_file_dirty(file_index)
 
     def remove_css_param(self, style_name, param_name):
-        style = self.get_css_style_by_name(style_name)
-        if style is None:
+        file_index, rule = self.get_css_rule_by_name(style_name)
+        if rule is None:
             return
-        style.removeProperty(param_name)
+        if param_name == 'font-family':
+            self.count_font_usage(self.get_rule_font_family(rule), -1)
+        rule.style.removeProperty(param_name)
+        self.mark_css_file_dirty(file_index)
 
     def get_css_file_paths(self):
         return [str(path) for path in self.css_file_paths]
@@ -125,11 +276,35 @@ class FileManager:
         return name_list
 
     def get_css_style_by_name(self, name):
-        for file in self.css_files:
-            for item in file.cssRules.rulesOfType(cssutils.css.CSSRule.STYLE_RULE):
-                if name == item.selectorText:
-                    return item.style
-        return None
+        _, rule = self.get_css_rule_by_name(name)
+        if rule is None:
+            return None
+        return rule.style
+
+    def get_css_rule_text(self, style_name):
+        """
+        Returns tuple: (name of the stylesheet in the book, selector,
+        declarations) for the rule edited under `style_name`,
+        or `None` if there is no such rule
+        """
+        file_index, rule = self.get_css_rule_by_name(style_name)
+        if rule is None:
+            return None
+        return (self.container.member_name(self.css_file_paths[file_index]),
+                rule.selectorText, rule.style.cssText)
+
+    # Returns a tuple: (index of CSS file, rule) or (None, None) if not found
+    # If the selector is used by several rules, the first one is returned
+    def get_css_rule_by_name(self, name):
+        rules = self.style_index.get(name)
+        if not rules:
+            return None, None
+        return rules[0]
+
+    # Returns a list of tuples: (index of CSS file, rule), one for each rule
+    # using given selector, in order of appearance
+    def get_css_rules_by_name(self, name):
+        return list(self.style_index.get(name, []))
 
     def get_all_css_fonts(self):
         font_list = []
@@ -166,14 +341,22 @@ class FileManager:
 
         # Manually overwrite specified file
         try:
-            css_file = open(file_path, "w")
-            css_file.write(text)
-            css_file.close()
-        except FileNotFoundError as e:
+            self.container.write(file_path, text.encode('utf-8'))
+        except (FileNotFoundError, ValueError) as e:
             print(f"Could not save CSS file due to {e}")
+            return
 
-        # Reload all CSS files
-        self.load_css_files()
+        # Reload only the overwritten file, it is written as typed,
+        # so after the reload it is not dirty
+        file_path = Path(file_path)
+        for i in range(self.get_css_file_count()):
+            if self.css_file_paths[i] == file_path:
+                self.reload_css_file(i)
+                self.css_rules_changed = True
+
+        # Only selectors added by the edit are matched
+        if self.selector_index is not None:
+            self.selector_index.update(self.style_index.keys())
 
     def set_css_file_by_path(self, file_path):
         for i in range(len(self.css_files)):
@@ -189,29 +372,39 @@ class FileManager:
     def get_css_file_count(self):
         return len(self.css_files)
 
+    # Returns 0 if succeeded, or a positive number otherwise
     def save_book(self, file_path):
 
-        save_path = Path(file_path).resolve()
+        snapshot = self.prepare_save()
+        try:
+            temp_path = snapshot.write(file_path)
+        except OSError as e:
+            print(f"Could not save file due to {e}")
+            return 1
+
+        return self.finish_save(snapshot, temp_path, file_path)
+
+    def prepare_save(self):
+        """
+        Writes pending changes and returns snapshot of the book, which can be
+        written by `SaveSnapshot.write` in another thread while editing goes on
+        """
         self.update_css()
         self.pathfinder.save_rendition_file()
+        return self.container.snapshot(self.pathfinder.get_rendition_media_types(),
+                                       self.compression_policy, self.save_workers)
 
-        # folder_name = path.splitext(path.basename(save_path))[0]
-        # will get permission error if there is a folder with name "folder_name"
-        # in save_dir
+    # Moves the book written from snapshot into place
+    # Returns 0 if succeeded, or a positive number otherwise
+    def finish_save(self, snapshot, temp_path, file_path):
         try:
-            book = ZipFile(save_path, 'w', ZIP_DEFLATED)
-
-            for root, dirs, files in walk(self.edition_dir):
-                for file in files:
-                    file_path = Path(root) / file
-                    book.write(file_path,
-                               file_path.relative_to(self.edition_dir))
-            book.close()
-        except PermissionError as e:
+            self.container.finish_save(snapshot, temp_path, Path(file_path).resolve())
+        except OSError as e:
             print(f"Could not save file due to {e}")
-            return
+            return 1
 
         print('File saved')
+        return 0
 
     def get_page(self, page_nr):
 
@@ -225,10 +418,55 @@ class FileManager:
         elif page_nr >= self.get_page_count():
             page_nr = 0
 
-        page_file_path = self.edition_dir / self.page_files_paths[page_nr]
+        page_name = self.container.member_name(self.page_files_paths[page_nr])
 
         # Also return page nr, because it can change
-        return page_nr, QUrl.fromLocalFile(page_file_path)
+        return page_nr, page_name
+
+    def get_member_data(self, name):
+        """
+        Returns tuple: (content, media type) of the file from the book,
+        stylesheets with their unsaved edits,
+        or `None` if there is no such file
+        """
+        name = self.container.member_name(name)
+        if not self.container.exists(name):
+            return None
+
+        media_type = self.pathfinder.get_media_type(name)
+        if media_type is None:
+            media_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+
+        for i in range(self.get_css_file_count()):
+            if self.is_css_file_dirty(i) and \
+                    self.container.member_name(self.css_file_paths[i]) == name:
+                return self.css_files[i].cssText, media_type
+        return self.container.read(name), media_type
+
+    def create_selector_index(self):
+        """
+        Parses all pages and matches selectors of loaded stylesheets.
+        Does not change the state, so that it can run in another thread
+        """
+        index = SelectorIndex.from_documents([self.container.read(path) for path in self.page_files_paths])
+        index.update(list(self.style_index))
+        return index
+
+    # Returns tuple: (number of matched elements, number of pages with them),
+    # or None if it is not known
+    def get_style_match_count(self, style_name):
+        if self.selector_index is None:
+            return None
+        return self.selector_index.get_match_count(style_name)
+
+    # Returns number of the next page using the style, or None
+    def get_next_page_using_style(self, style_name, page_nr):
+        if self.selector_index is None:
+            return None
+        return self.selector_index.get_next_page(style_name, page_nr)
+
+    def get_member_size(self, name):
+        return self.container.get_size(name)
 
     def get_page_count(self):
         return len(self.page_files_paths)
@@ -241,8 +479,8 @@ class FileManager:
             file_name = file_name.split('.', 1)[0]
 
         new_path = self.edition_dir / self.pathfinder.get_font_folder_path() / path_obj.name
-        makedirs(new_path.parent, exist_ok=True)
-        copyfile(file_path, new_path)
+        with open(file_path, 'rb') as font_file:
+            self.container.write(new_path, font_file.read())
 
         attributes = [
             "font_" + file_name,
@@ -261,10 +499,7 @@ class FileManager:
             file_name = file_name.split('.', 1)[0]
 
         new_path = self.edition_dir / self.pathfinder.get_font_folder_path() / path_obj.name
-        try:
-            remove(Path(new_path).resolve())
-        except FileNotFoundError as e:
-            print(e)
+        self.container.remove(new_path)
 
         attributes = [
             "font_" + file_name,
@@ -282,50 +517,32 @@ class FileManager:
         pass
 
     def add_css_font_property(self, font, book_relative_path):
-        font_list = self.get_all_css_fonts()
-
         # Check if such property already exists
-        for css_font in font_list:
-            font_family = css_font.getProperties('font-family')[0].propertyValue.cssText
-            if font_family == font.name:
-                return
+        if self.font_face_index.get(font.name):
+            return
 
         # Add this to any CSS file
         css_relative_path = relpath(book_relative_path, self.css_file_paths[0].parent)
         font_path = css_relative_path.replace(sep, '/')
         font_style = CSSStyleDeclaration()
-        font_style.setProperty('font-family', value=font.name)
+        font_style.setProperty('font-family', value=Font.quote_family(font.name))
         font_style.setProperty('src', value=f'url("{font_path}")')
-        self.css_files[0].add(CSSFontFaceRule(style=font_style))
+        font_face_rule = CSSFontFaceRule(style=font_style)
+        self.css_files[0].add(font_face_rule)
+        self.index_font_face_rule(0, font_face_rule)
+        self.mark_css_file_dirty(0)
+        self.css_rules_changed = True
 
     def remove_css_font_property(self, font):
-        for file in self.css_files:
-            for index, rule in enumerate(file.cssRules):
-                if type(rule) == CSSFontFaceRule and rule.style.getProperties('font-family')[0].propertyValue.cssText \
-                        == font.name:
-                    file.deleteRule(index)
-                    pass
+        for file_index, rule in self.font_face_index.pop(font.name, []):
+            self.css_files[file_index].deleteRule(rule)
+            self.mark_css_file_dirty(file_index)
+            self.css_rules_changed = True
 
+    # Returns font families used by style rules, first ones of their lists
     def get_used_font_name_list(self):
-        font_list = []
-        for file in self.css_files:
-            for rule in file.cssRules.rulesOfType(cssutils.css.CSSRule.STYLE_RULE):
-                props = rule.style.getProperties('font-family')
-                if len(props) < 1:
-                    continue
-
-                font_text = props[0].propertyValue.cssText
-                if ',' in font_text:
-                    font_text = font_text.split(',', 1)[0]
-
-                if font_text not in font_list:
-                    font_list.append(font_text)
-
-        return font_list
+        return list(self.font_usage)
 
+    # Returns font families declared by @font-face rules
     def get_css_font_name_list(self):
-        font_list = []
-        for file in self.css_files:
-            for item in file.cssRules.rulesOfType(cssutils.css.CSSRule.FONT_FACE_RULE):
-                font_list.append(item.style.getProperties('font-family')[0].propertyValue.cssText)
-        return font_list
+        return list(self.font_face_index)
@@ -1,7 +1,10 @@
+from bisect import bisect_left, insort
 from pathlib import Path
 
 
 class Font:
+    __slots__ = ('name', 'fallback', 'file_path', 'file_type')
+
     TYPE_NO_FILE = 0
     TYPE_LOCAL_FILE = 1
     TYPE_FROM_EPUB = 2
@@ -50,15 +53,33 @@ class Font:
             font_family = 'serif'
         return font_family
 
+    # Returns family name as a CSS string, unquoted names like
+    # "Press Start 2P" are not valid, because "2P" is read as a dimension
+    @staticmethod
+    def quote_family(font_name):
+        return '"' + font_name.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+    # Returns family name without quotes, for comparing names
+    @staticmethod
+    def unquote_family(css_text):
+        font_name = css_text.strip()
+        if len(font_name) >= 2 and font_name[0] == font_name[-1] and font_name[0] in '\'"':
+            quote = font_name[0]
+            font_name = font_name[1:-1].replace('\\' + quote, quote).replace('\\\\', '\\')
+        return font_name
+
+    # Returns CSS value of font-family using the font, with its fallback if there is one
+    def get_css_string(self):
+        parts = [self.quote_family(self.name), (self.fallback or '').strip()]
+        return ', '.join(part for part in parts if part)
+
     @staticmethod
     def get_font_from_css_string(css_string):
-        font_name = css_string
+        font_name = Font.unquote_family(css_string)
         fallback_font = ''
         if ',' in css_string:
-            font_name = css_string.split(',')[0]
-            if font_name[0] == "'" or font_name[0] == '"':
-                font_name = font_name[1:-1]
-            
+            font_name = Font.unquote_family(css_string.split(',')[0])
+
             fallback_font = css_string.split(',', 1)[1].strip()
 
         if fallback_font == '':
@@ -78,3 +99,100 @@ class Font:
         file_string = ''
 
         return f"{type_str}{self.name} ({self.fallback}){file_string}"
+
+
+class FontRegistry:
+    """
+    Fonts known to the editor, indexed by description (`str(font)`), exact
+    name, normalized name and prefix of description.\n
+    Listeners are called with the list of fonts added by every insert
+    """
+    def __init__(self) -> None:
+        self._by_desc = dict[str, Font]()
+        # The first registered font with the name
+        self._by_name = dict[str, Font]()
+        self._by_normalized_name = dict[str, Font]()
+        # Sorted, prefixes are found by bisection
+        self._descriptions = list[str]()
+        self._listeners = []
+
+    def __len__(self) -> int:
+        return len(self._by_desc)
+
+    def __contains__(self, desc: str) -> bool:
+        return desc in self._by_desc
+
+    def __iter__(self):
+        return iter(self._by_desc.values())
+
+    @staticmethod
+    def normalize_name(name: str) -> str:
+        """
+        Returns name without quotes, in lower case, with single spaces
+        """
+        return ' '.join(name.strip('\'" ').casefold().split())
+
+    def add_listener(self, listener) -> None:
+        self._listeners.append(listener)
+
+    def add(self, font: Font, unique_name: bool = False) -> bool:
+        return len(self.add_fonts([font], unique_name)) > 0
+
+    def add_fonts(self, fonts: list[Font], unique_name: bool = False)\
+            -> list[Font]:
+        """
+        Adds fonts whose descriptions are not registered yet. With
+        `unique_name` also fonts with registered names are skipped.
+        Returns the added fonts
+        """
+        added = []
+        for font in fonts:
+            desc = str(font)
+            normalized_name = self.normalize_name(font.name)
+            if desc in self._by_desc or \
+                    (unique_name and normalized_name in self._by_normalized_name):
+                continue
+            self._by_desc[desc] = font
+            self._by_name.setdefault(font.name, font)
+            self._by_normalized_name.setdefault(normalized_name, font)
+            added.append(font)
+
+        if len(added) == 0:
+            return added
+        if len(added) == 1:
+            insort(self._descriptions, str(added[0]))
+        else:
+            self._descriptions.extend(str(font) for font in added)
+            self._descriptions.sort()
+        for listener in self._listeners:
+            listener(added)
+        return added
+
+    def get_descriptions(self) -> list[str]:
+        """
+        Returns sorted descriptions of all fonts
+        """
+        return list(self._descriptions)
+
+    def get_by_name(self, name: str) -> Font:
+        """
+        Returns font with the name, compared exactly and then normalized,
+        or `None`
+        """
+        font = self._by_name.get(name)
+        if font is None:
+            font = self._by_normalized_name.get(self.normalize_name(name))
+        return font
+
+    def get_by_desc(self, desc: str) -> Font:
+        """
+        Returns font with the description, or the first one (in sorted
+        order) which description starts with it, or `None`
+        """
+        font = self._by_desc.get(desc)
+        if font is not None:
+            return font
+        i = bisect_left(self._descriptions, desc)
+        if i < len(self._descriptions) and self._descriptions[i].startswith(desc):
+            return self._by_desc[self._descriptions[i]]
+        return None
@@ -0,0 +1,262 @@
+"""
+Catalogue of TrueType fonts from a directory, with metadata read from
+the fonts themselves, cached on disk between runs
+"""
+import json
+import os
+import struct
+from pathlib import Path
+
+from font import Font
+
+CATALOGUE_FORMAT = 2
+FONT_EXTENSION = '.ttf'
+
+# Names of a style, under which the font is known just by its family
+REGULAR_STYLES = ['regular', 'normal', 'book', 'roman', 'plain']
+
+NAME_FAMILY = 1
+NAME_STYLE = 2
+NAME_TYPOGRAPHIC_FAMILY = 16
+NAME_TYPOGRAPHIC_STYLE = 17
+
+
+def _read_tables(file, tags: list[bytes]) -> dict[bytes, bytes]:
+    header = file.read(12)
+    if len(header) < 12 or header[:4] not in (b'\x00\x01\x00\x00', b'true',
+                                              b'OTTO'):
+        raise ValueError('Not a TrueType font')
+    table_count = struct.unpack('>H', header[4:6])[0]
+    directory = file.read(16 * table_count)
+    tables = {}
+    for i in range(table_count):
+        tag, _, offset, length = struct.unpack_from('>4sLLL', directory, 16 * i)
+        if tag in tags:
+            tables[tag] = (offset, length)
+    for tag, (offset, length) in tables.items():
+        file.seek(offset)
+        tables[tag] = file.read(length)
+    return tables
+
+
+def _read_names(table: bytes) -> dict[int, str]:
+    """
+    Returns name id -> string, English Windows names are preferred
+    """
+    _, count, strings_offset = struct.unpack_from('>HHH', table, 0)
+    names = {}
+    priorities = {}
+    for i in range(count):
+        platform, encoding, language, name_id, length, offset =\
+            struct.unpack_from('>HHHHHH', table, 6 + 12 * i)
+        data = table[strings_offset + offset:strings_offset + offset + length]
+        if platform == 3 and encoding in (0, 1, 10):
+            priority = 0 if language == 0x409 else 1
+            codec = 'utf-16-be'
+        elif platform == 0:
+            priority, codec = 2, 'utf-16-be'
+        elif platform == 1 and encoding == 0:
+            priority, codec = 3, 'mac_roman'
+        else:
+            continue
+        if priorities.get(name_id, 4) <= priority:
+            continue
+        try:
+            names[name_id] = data.decode(codec).strip()
+        except UnicodeDecodeError:
+            continue
+        priorities[name_id] = priority
+    return names
+
+
+def _guess_fallback(os2: bytes, post: bytes, name: str) -> str:
+    if post is not None and len(post) >= 16 and\
+       struct.unpack_from('>L', post, 12)[0] != 0:  # isFixedPitch
+        return 'monospace'
+    if os2 is None or len(os2) < 42:
+        return Font.guess_font_family(name.lower())
+
+    family_class = os2[30]  # High byte of sFamilyClass
+    panose_family, panose_serif, _, panose_proportion = os2[32:36]
+    if panose_family == 2 and panose_proportion == 9:
+        return 'monospace'
+    if panose_family == 3 or family_class == 10:
+        return 'cursive'
+    if family_class == 8 or (panose_family == 2 and 11 <= panose_serif <= 13):
+        return 'sans-serif'
+    if 1 <= family_class <= 7 or (panose_family == 2 and 2 <= panose_serif <= 10):
+        return 'serif'
+    return Font.guess_font_family(name.lower())
+
+
+def read_font_metadata(file_path: str) -> dict:
+    """
+    Returns dictionary with family, style, weight, generic fallback
+    family of the font and whether it is a variable font, read from its `name`, `OS/2` and `post` tables.
+    Raises `ValueError` if the file is not a valid TrueType font
+    """
+    try:
+        with open(file_path, 'rb') as file:
+            tables = _read_tables(file, [b'name', b'OS/2', b'post', b'fvar'])
+        if b'name' not in tables:
+            raise ValueError('Font has no name table')
+        names = _read_names(tables[b'name'])
+    except struct.error as e:
+        raise ValueError(f'Font is damaged ({e})') from e
+
+    family = names.get(NAME_TYPOGRAPHIC_FAMILY) or names.get(NAME_FAMILY)
+    if not family:
+        raise ValueError('Font has no family name')
+    style = names.get(NAME_TYPOGRAPHIC_STYLE) or names.get(NAME_STYLE) or\
+        'Regular'
+    variable = b'fvar' in tables
+    if variable:
+        # Variable font covers all styles, named one is just the default
+        style = 'Regular'
+    os2 = tables.get(b'OS/2')
+    weight = 400
+    if os2 is not None and len(os2) >= 6:
+        weight = struct.unpack_from('>H', os2, 4)[0]
+    return {'family': family, 'style': style, 'weight': weight,
+            'fallback': _guess_fallback(os2, tables.get(b'post'), family),
+            'variable': variable}
+
+
+class FontCatalogue:
+    """
+    Fonts found in `fonts_dir` and its subdirectories, with their metadata.\n
+    The catalogue is kept in `cache_path`, with modification time and size
+    of every font and modification time of every directory, so that
+    only new or changed fonts are read again
+    """
+    def __init__(self, fonts_dir: str, cache_path: str) -> None:
+        self.fonts_dir = Path(fonts_dir)
+        self.cache_path = Path(cache_path)
+        # Path relative to fonts_dir -> metadata, with 'mtime' and 'size'
+        self.fonts = dict[str, dict]()
+        # Path relative to fonts_dir -> {'mtime': ..., 'subdirs': [...]}
+        self.dirs = dict[str, dict]()
+        self._visited_dirs = set[str]()
+        self._changed = False
+        self.load()
+
+    def load(self) -> None:
+        try:
+            with open(self.cache_path, 'r', encoding='utf-8') as file:
+                catalogue = json.load(file)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            print(f"Could not read font catalogue due to {e}")
+            return
+        if catalogue.get('format') != CATALOGUE_FORMAT:
+            return
+        self.fonts = catalogue.get('fonts', {})
+        self.dirs = catalogue.get('dirs', {})
+
+    def save(self) -> None:
+        if not self._changed:
+            return
+        temp_path = self.cache_path.with_name(self.cache_path.name + '.tmp')
+        try:
+            os.makedirs(self.cache_path.parent, exist_ok=True)
+            with open(temp_path, 'w', encoding='utf-8') as file:
+                json.dump({'format': CATALOGUE_FORMAT, 'fonts': self.fonts,
+                           'dirs': self.dirs}, file)
+            os.replace(temp_path, self.cache_path)
+        except OSError as e:
+            print(f"Could not save font catalogue due to {e}")
+            return
+        self._changed = False
+
+    def scan(self, check_files: bool = True) -> list[Font]:
+        """
+        Updates the catalogue and returns fonts from it. Without
+        `check_files` only directories are checked, files of unchanged
+        directories are not even listed
+        """
+        found = dict[str, dict]()
+        self._visited_dirs = set[str]()
+        if self.fonts_dir.is_dir():
+            self._scan_dir('.', check_files, found)
+        if found.keys() != self.fonts.keys():
+            self._changed = True
+        self.fonts = found
+        self.dirs = {path: info for path, info in self.dirs.items()
+                     if path in self._visited_dirs}
+        self.save()
+        return self.get_fonts()
+
+    def get_fonts(self) -> list[Font]:
+        """
+        Returns fonts named by their family and style, variable fonts are
+        named "<family> Variable", so that they are told apart from their
+        static files. Copies of the same font get the same name, only the
+        first one (in order of paths) is kept by `FontRegistry`
+        """
+        fonts = []
+        for path, metadata in sorted(self.fonts.items()):
+            font = Font(str(self.fonts_dir / path), file_type=Font.TYPE_LOCAL_FILE,
+                        fallback=metadata['fallback'])
+            font.name = metadata['family']
+            if metadata['style'].lower() not in REGULAR_STYLES:
+                font.name += ' ' + metadata['style']
+            if metadata.get('variable'):
+                font.name += ' Variable'
+            fonts.append(font)
+        return fonts
+
+    def _scan_dir(self, path: str, check_files: bool, found: dict) -> None:
+        self._visited_dirs.add(path)
+        dir_path = self.fonts_dir / path
+        try:
+            mtime = os.stat(dir_path).st_mtime_ns
+        except OSError:
+            return
+        cached_dir = self.dirs.get(path)
+
+        if not check_files and cached_dir is not None and\
+           cached_dir['mtime'] == mtime:
+            # Files were neither added nor removed
+            prefix = '' if path == '.' else path + '/'
+            for font_path, metadata in self.fonts.items():
+                if font_path.startswith(prefix) and '/' not in font_path[len(prefix):]:
+                    found[font_path] = metadata
+            subdirs = cached_dir['subdirs']
+        else:
+            subdirs = []
+            try:
+                entries = list(os.scandir(dir_path))
+            except OSError as e:
+                print(f"Could not scan fonts due to {e}")
+                entries = []
+            for entry in entries:
+                entry_path = entry.name if path == '.' else f'{path}/{entry.name}'
+                if entry.is_dir():
+                    subdirs.append(entry_path)
+                elif entry.is_file() and entry.name.lower().endswith(FONT_EXTENSION):
+                    found[entry_path] = self._get_metadata(entry_path, entry.stat())
+            self.dirs[path] = {'mtime': mtime, 'subdirs': sorted(subdirs)}
+            self._changed = self._changed or cached_dir != self.dirs[path]
+
+        for subdir in subdirs:
+            self._scan_dir(subdir, check_files, found)
+
+    def _get_metadata(self, path: str, stat: os.stat_result) -> dict:
+        cached = self.fonts.get(path)
+        if cached is not None and cached['mtime'] == stat.st_mtime_ns and\
+           cached['size'] == stat.st_size:
+            return cached
+
+        try:
+            metadata = read_font_metadata(self.fonts_dir / path)
+        except (OSError, ValueError) as e:
+            print(f"Could not read font {path} due to {e}")
+            name = Path(path).name.split('.', 1)[0]
+            metadata = {'family': name, 'style': 'Regular', 'weight': 400,
+                        'fallback': Font.guess_font_family(name.lower()),
+                        'variable': False}
+        metadata['mtime'] = stat.st_mtime_ns
+        metadata['size'] = stat.st_size
+        self._changed = True
+        return metadata
@@ -1,12 +1,19 @@
-from PySide6.QtCore import Qt, QUrl
+from PySide6.QtCore import Qt, QUrl, QBuffer, QIODevice, QObject
 from PySide6.QtGui import QFont, QDoubleValidator
-from PySide6.QtWebEngineCore import QWebEnginePage
+from PySide6.QtWebEngineCore import QWebEnginePage, QWebEngineUrlRequestJob, QWebEngineUrlScheme, \
+    QWebEngineUrlSchemeHandler
 from PySide6.QtWebEngineWidgets import QWebEngineView
 from PySide6.QtWidgets import QComboBox, QMenuBar, QSlider, QTextEdit, QVBoxLayout, QHBoxLayout, QWidget, QLabel, \
     QPushButton, QLineEdit
 from highlighter import Highlighter
+from preview import BOOK_SCHEME
 from utility import hex_to_rgb, rgb_to_hex
 
+# Pages kept loaded off-screen, by default the next and the previous one
+PREFETCHED_PAGES = 2
+# Limit of the summed size of documents of prefetched pages, in bytes
+PREFETCH_MAX_SIZE = 8 * 1024 * 1024
+
 
 class MyMenuBar(QMenuBar):
     def __init__(self):
@@ -36,6 +43,131 @@ class MyWebEnginePage(QWebEnginePage):
         return 'MyPage'
 
 
+class PagePool(QObject):
+    """
+    Pages of the book loaded off-screen, so that they can be shown at once.
+    At most `max_pages` pages are kept, as long as their documents
+    take no more than `max_size` bytes together
+    """
+    def __init__(self, max_pages=PREFETCHED_PAGES, max_size=PREFETCH_MAX_SIZE, parent=None):
+        super().__init__(parent)
+        self.max_pages = max_pages
+        self.max_size = max_size
+        self.pages = {}  # Url -> [page, size of document, is loaded]
+
+    def has_room(self, size):
+        used_size = sum(entry[1] for entry in self.pages.values())
+        return len(self.pages) < self.max_pages and used_size + size <= self.max_size
+
+    def take(self, url):
+        """
+        Returns loaded page with given url, which is no longer kept,
+        or None if there is no such page
+        """
+        entry = self.pages.get(url.toString())
+        if entry is None or not entry[2]:
+            return None
+        del self.pages[url.toString()]
+        return entry[0]
+
+    def put(self, page, url, size):
+        """
+        Keeps loaded page, which is no longer shown, if there is room for it
+        """
+        page.setParent(self)  # Otherwise view deletes the page it owns, when it is replaced
+        self.remove(url.toString())
+        if not self.has_room(size):
+            page.deleteLater()
+            return
+        self.pages[url.toString()] = [page, size, True]
+
+    def prefetch(self, urls_and_sizes):
+        """
+        Loads pages from the list of (url, size of document), in order,
+        as many as there is room for. Other pages are removed
+        """
+        wanted = [url.toString() for url, _ in urls_and_sizes]
+        for key in list(self.pages):
+            if key not in wanted:
+                self.remove(key)
+
+        for url, size in urls_and_sizes:
+            key = url.toString()
+            if key in self.pages:
+                continue
+            if not self.has_room(size):
+                break
+            page = MyWebEnginePage(self)
+            page.loadFinished.connect(lambda ok, key=key, page=page: self.on_load_finished(key, page, ok))
+            self.pages[key] = [page, size, False]
+            page.load(url)
+
+    def on_load_finished(self, key, page, ok):
+        entry = self.pages.get(key)
+        if entry is None or entry[0] is not page:  # Page has been taken or removed
+            return
+        if ok:
+            entry[2] = True
+        else:
+            self.remove(key)
+
+    def run_script(self, script):
+        """
+        Runs script in the loaded pages, ones for which it returns false
+        are removed, as they can not be kept up to date
+        """
+        for key, (page, _, loaded) in list(self.pages.items()):
+            if loaded:
+                page.runJavaScript(script, 0, lambda result, key=key, page=page:
+                                   self.on_script_finished(key, page, result))
+
+    def on_script_finished(self, key, page, result):
+        entry = self.pages.get(key)
+        if result is False and entry is not None and entry[0] is page:
+            self.remove(key)
+
+    def remove(self, key):
+        entry = self.pages.pop(key, None)
+        if entry is not None:
+            entry[0].deleteLater()
+
+    def clear(self):
+        for key in list(self.pages):
+            self.remove(key)
+
+
+# Has to be called before the application is created
+def register_book_scheme():
+    scheme = QWebEngineUrlScheme(BOOK_SCHEME.encode())
+    scheme.setSyntax(QWebEngineUrlScheme.Syntax.Path)
+    scheme.setFlags(QWebEngineUrlScheme.LocalScheme | QWebEngineUrlScheme.LocalAccessAllowed |
+                    QWebEngineUrlScheme.CorsEnabled)
+    QWebEngineUrlScheme.registerScheme(scheme)
+
+
+class BookSchemeHandler(QWebEngineUrlSchemeHandler):
+    """
+    Serves files of the book opened in file_manager straight from memory
+    or the archive, stylesheets with their unsaved edits
+    """
+    def __init__(self, file_manager, parent=None):
+        super().__init__(parent)
+        self.file_manager = file_manager
+
+    def requestStarted(self, job):
+        name = job.requestUrl().path(QUrl.FullyDecoded).lstrip('/')
+        member = self.file_manager.get_member_data(name)
+        if member is None:
+            job.fail(QWebEngineUrlRequestJob.UrlNotFound)
+            return
+
+        data, media_type = member
+        buffer = QBuffer(job)  # Deleted together with the job
+        buffer.setData(data)
+        buffer.open(QIODevice.ReadOnly)
+        job.reply(media_type.encode(), buffer)
+
+
 class CSSEditor(QTextEdit):
     def __init__(self):
         super().__init__()
@@ -3,8 +3,10 @@ from PySide6.QtWidgets import QApplication
 # Only needed for access to command line arguments
 import sys
 import os
+from multiprocessing import freeze_support
 from pathlib import Path
 from main_window import MainWindow
+from gui_elements import register_book_scheme
 from qt_material import apply_stylesheet
 
 debug = False
@@ -14,6 +16,7 @@ if folder_name == "pzsp2":
 
 
 def start_app():
+    register_book_scheme()
     app = QApplication(sys.argv)
     screen_size = app.primaryScreen().availableGeometry().size()
     apply_stylesheet(app, theme='dark_blue.xml')
@@ -36,4 +39,7 @@ def main():
 
 
 if __name__ == '__main__':
+    # Stylesheets are parsed in worker processes, which the frozen
+    # executable has to be able to start
+    freeze_support()
     main()
@@ -1,13 +1,17 @@
 from pathlib import Path
 from PySide6.QtGui import QAction, QKeySequence, QIcon
+from PySide6.QtWebEngineCore import QWebEngineProfile
 from PySide6.QtWidgets import QFileDialog, QMainWindow, QStackedLayout
 
 from gui_elements import *
 from file_manager import FileManager
 from utility import *
+from workers import LoadThread, SaveThread
+from preview import BOOK_SCHEME, RefreshScheduler, build_highlight_script, build_rule_update_script, get_book_url
 
 import re
-from font import Font
+from font import Font, FontRegistry
+from font_catalogue import FontCatalogue
 
 RESULT_SUCCESS = 0  # Return value
 RESULT_CANCEL = 2
@@ -28,6 +32,9 @@ class MainWindow(QMainWindow):
     def closeEvent(self, evnt):
         print("Closing")
 
+        self.wait_for_load()
+        self.wait_for_save()
+
         result = self.file_save_prompt()
         if result == RESULT_CANCEL:
             evnt.ignore()
@@ -44,15 +51,32 @@ class MainWindow(QMainWindow):
         self.current_page_nr = 0
         self.edited_css_path = None
         self.file_manager = FileManager()
+        self.save_thread = None
+        self.load_thread = None
+        self.page_changed = False
+        self.page_loading = False
+        # Preview shows files of the book without writing them to disk
+        self.book_scheme_handler = BookSchemeHandler(self.file_manager, self)
+        QWebEngineProfile.defaultProfile().installUrlSchemeHandler(BOOK_SCHEME.encode(), self.book_scheme_handler)
+
+        self.page_pool = PagePool(parent=self)
+        self.shown_page_name = None
+
+        # Bursts of edits are shown in the preview with one refresh
+        self.refresh_scheduler = RefreshScheduler(self.refresh_view, parent=self)
 
         # Load built-in fonts
-        self.fonts = {}
-        for font_name, fallback_font in font_list_built_in:
-            font = Font(font_name, Font.TYPE_NO_FILE, fallback=fallback_font)
-            self.fonts[str(font)] = font
+        self.fonts = FontRegistry()
+        self.fonts.add_fonts([Font(font_name, Font.TYPE_NO_FILE, fallback=fallback_font)
+                              for font_name, fallback_font in font_list_built_in])
 
-        # Import additional fonts from 'fonts' folder
-        self.import_fonts()
+        # Import additional fonts from 'fonts' folder, files of unchanged folders are not checked on startup
+        self.font_catalogue = FontCatalogue(Path(__file__).parent / 'fonts',
+                                            Path(__file__).parent / 'cache' / 'fonts.json')
+        self.import_fonts(check_files=False)
+
+        # Font list is filled when interface is set up, later it is updated on changes
+        self.fonts.add_listener(self.on_fonts_added)
 
     def reload_interface(self):
         self.setup_menubar()
@@ -78,7 +102,7 @@ class MainWindow(QMainWindow):
 
         font_import_action = QAction(text='Import fonts', parent=self)
         font_import_action.setShortcut(QKeySequence('Ctrl+Alt+f'))
-        font_import_action.triggered.connect(self.import_fonts)
+        font_import_action.triggered.connect(lambda: self.import_fonts())
         self.menu.file_menu.addAction(font_import_action)
 
         self.view_change_action = QAction(text='Change view to text editor', parent=self)
@@ -96,6 +120,11 @@ class MainWindow(QMainWindow):
         prev_page_action.triggered.connect(self.prev_page)
         self.menu.view_menu.addAction(prev_page_action)
 
+        next_style_page_action = QAction(text='Next page using this style', parent=self)
+        next_style_page_action.setShortcut(QKeySequence('Ctrl+Alt+.'))
+        next_style_page_action.triggered.connect(self.next_style_page)
+        self.menu.view_menu.addAction(next_style_page_action)
+
     def setup_right_panel(self):
         self.setup_webview()
         self.setup_page_control_buttons()
@@ -108,6 +137,7 @@ class MainWindow(QMainWindow):
 
     def setup_webview(self):
         self.webview = MyWebView()
+        self.webview.loadStarted.connect(self.on_webview_load_started)
         self.webview.loadFinished.connect(self.on_webview_reload)
 
     def setup_page_control_buttons(self):
@@ -147,6 +177,9 @@ class MainWindow(QMainWindow):
         self.basic_font_editor = BasicFontEditor(label_style, 'Font', self.change_font, self.set_font_size,
                                                  self.trigger_basic_css_prop)
         self.combo_box_font = self.basic_font_editor.combo_box
+        self.set_interface_signal_lock(True)
+        self.update_font_list()
+        self.set_interface_signal_lock(False)
         self.misc_prop_editor = MiscCSSPropertyEditor(label_style, 'Other properties', self.set_misc_css_prop,
                                                       self.remove_misc_css_prop, self.update_misc_value)
         self.color_box = ColorBox(label_style, 'Font color', self.change_color_slider,
@@ -213,10 +246,7 @@ class MainWindow(QMainWindow):
         if font is None:
             raise Exception(f"Chosen font: |{chosen_font}| has not been found")
 
-        if len(font.fallback.strip()) == 0:
-            self.file_manager.set_css_param(style_name, 'font-family', f'{font.name}')
-        else:
-            self.file_manager.set_css_param(style_name, 'font-family', f'{font.name}, {font.fallback}')
+        self.file_manager.set_css_param(style_name, 'font-family', font.get_css_string())
 
         self.check_add_used_fonts()
         self.update_editor()
@@ -249,10 +279,12 @@ class MainWindow(QMainWindow):
         self.color_box.set_color_label(f"Color: RGB ({r}, {g}, {b}) = {hex_string}")
 
         self.file_manager.set_css_param(style_name, 'color', hex_string)
+        self.update_view()  # Only the rule is injected, so it is cheap enough for every tick
 
     # Connected to combo_box_style
     def change_edit_style(self):
         self.update_editor()
+        self.show_style_match_count()
 
     def set_interface_signal_lock(self, on):
         self.combo_box_font.blockSignals(on)
@@ -272,9 +304,7 @@ class MainWindow(QMainWindow):
     def update_font_list(self):
         self.combo_box_font.clear()
         self.combo_box_font.addItem("[None]")
-        font_list = self.get_font_descriptions()
-        font_list.sort()
-        self.combo_box_font.addItems(font_list)
+        self.combo_box_font.addItems(self.get_font_descriptions())  # Already sorted
 
     def parse_font_size_str(self, string):
         font_size_str = re.match(r"([0-9.]*)([a-zA-Z%]*)", string)
@@ -282,49 +312,40 @@ class MainWindow(QMainWindow):
         font_size_unit = font_size_str.group(2)
         return font_size, font_size_unit
 
+    def on_fonts_added(self, fonts):
+        # Selected font stays selected, without being set again
+        self.set_interface_signal_lock(True)
+        selected_font = self.combo_box_font.currentText()
+        self.update_font_list()
+        self.combo_box_font.setCurrentIndex(max(self.combo_box_font.findText(selected_font, Qt.MatchFixedString), 0))
+        self.set_interface_signal_lock(False)
+
     def get_font_descriptions(self):
-        return [str(font) for font_desc, font in self.fonts.items()]
+        return self.fonts.get_descriptions()
 
     def get_font_by_name(self, name):
-        for font_desc, font in self.fonts.items():
-            if name == font.name:
-                return font
-        return None
+        return self.fonts.get_by_name(name)
 
     def get_font_by_desc(self, desc):
-        for font_desc, font in self.fonts.items():
-            if desc in font_desc:  # This way to also allow partial match
-                return font
-        return None
+        return self.fonts.get_by_desc(desc)  # Also allows partial match of the beginning
 
     def get_font_by_css_string(self, name):
         return self.get_font_by_name(Font.get_font_from_css_string(name).name)
 
     # Checks if all used fonts are in EPUB. Adds or removes fonts otherwise
     def check_add_used_fonts(self):
-        used_font_list = self.file_manager.get_used_font_name_list()
-        css_font_list = self.file_manager.get_css_font_name_list()
-
-        for font in used_font_list:
-            if font not in css_font_list:
-                font_obj = self.get_font_by_name(font)
-                if font_obj is not None and font_obj.file_type == Font.TYPE_LOCAL_FILE:
-                    self.file_manager.add_font_to_epub(font_obj)
-
-        # The inner for loop has to be restarted after every remove
-        # otherwise, a rare exception may occur that a font is skipped
-        # because other font was removed and the list has shortened
-        removed = True
-        while removed:
-            removed = False
-            css_font_list = self.file_manager.get_css_font_name_list()
-            for font in css_font_list:
-                if font not in used_font_list:
-                    font_obj = self.get_font_by_name(font)
-                    if font_obj is not None and font_obj.file_type == Font.TYPE_LOCAL_FILE:
-                        self.file_manager.remove_font_from_epub(font_obj)
-                        removed = True
-                        break
+        used_fonts = set(self.file_manager.get_used_font_name_list())
+        css_fonts = set(self.file_manager.get_css_font_name_list())
+
+        for font in used_fonts - css_fonts:
+            font_obj = self.get_font_by_name(font)
+            if font_obj is not None and font_obj.file_type == Font.TYPE_LOCAL_FILE:
+                self.file_manager.add_font_to_epub(font_obj)
+
+        for font in css_fonts - used_fonts:
+            font_obj = self.get_font_by_name(font)
+            if font_obj is not None and font_obj.file_type == Font.TYPE_LOCAL_FILE:
+                self.file_manager.remove_font_from_epub(font_obj)
 
     def get_current_style_name(self):
         return str(self.combo_box_style.currentText())
@@ -357,51 +378,85 @@ class MainWindow(QMainWindow):
         else:
             self.color_box.set_sliders_hex(color)
 
-        # Update font selectors, add new fonts to list if missing
+        # Update font selector, list of fonts is kept up to date by on_fonts_added
         current_font = self.file_manager.get_css_param(style_name, 'font-family')
 
-        self.update_font_list()
-
+        index = 0  # [None]
         font = self.get_font_by_css_string(current_font)
         if font is not None:
-            index = self.combo_box_font.findText(str(font), Qt.MatchFixedString)
-            if index >= 0:
-                self.combo_box_font.setCurrentIndex(index)
+            index = max(self.combo_box_font.findText(str(font), Qt.MatchFixedString), 0)
+        self.combo_box_font.setCurrentIndex(index)
 
         self.update_misc_value()
 
         self.set_interface_signal_lock(False)
 
     def update_view(self):
+        """
+        Schedules update of the text display on the right side,
+        edits made until it happens are shown together
+        """
+        self.refresh_scheduler.schedule()
+
+    def refresh_view(self):
         """
         Updates the text display on the right side.
-        Also applies temporary changes like currently-edited style highlight 
+        Declarations of the chosen style are injected into the shown page,
+        it is reloaded only if rules have been added or removed.
+        Currently-edited style is highlighted by an overlay added to the page only
         """
+        if self.file_manager.css_rules_changed:
+            self.file_manager.css_rules_changed = False
+            self.page_changed = True  # Highlight is added once page is loaded
+            self.page_pool.clear()  # Pages are prefetched again with new rules
+            # Reload still in flight is aborted, it could show outdated styles
+            self.webview.reload()
+            return
+
+        # Page being loaded gets the latest state once it finishes
+        if self.page_loading:
+            self.page_changed = True
+            return
+
         style_name = self.get_current_style_name()
+        if style_name != "":
+            self.inject_css_rule(style_name)
 
         # Highlight chosen style when control_panel is shown
-        if self.left_panel.layout().currentIndex() == 0 and style_name != "":
-            self.last_color = self.file_manager.get_css_param(style_name, 'background-color')
-            self.file_manager.set_css_param(style_name, 'background-color', HIGHLIGHT_COLOR_STRING)
-            self.temporary_changes = True
+        highlighted_style = ""
+        if self.left_panel.layout().currentIndex() == 0:
+            highlighted_style = style_name
+        self.webview.page().runJavaScript(build_highlight_script(highlighted_style, HIGHLIGHT_COLOR_STRING))
+
+    def inject_css_rule(self, style_name):
+        rule_text = self.file_manager.get_css_rule_text(style_name)
+        if rule_text is None:
+            return
+
+        script = build_rule_update_script(*rule_text)
+        self.webview.page().runJavaScript(script, 0, self.on_css_rule_injected)
+        self.page_pool.run_script(script)  # Keeps prefetched pages up to date
 
-            self.file_manager.update_css()
+    def on_css_rule_injected(self, result):
+        # Page uses the stylesheet, but the rule could not be found in it,
+        # so the page is reloaded with the edited stylesheet instead
+        if result is False:
             self.webview.reload()
 
-            self.file_manager.set_css_param(style_name, 'background-color', self.last_color)
-            return
+    def on_webview_load_started(self):
+        self.page_loading = True
 
-        # No temporary changes, just save and draw
-        self.file_manager.update_css()
-        self.webview.reload()
+    def on_webview_reload(self, ok=True):
+        # Aborted load is followed by the one which replaced it
+        if not ok:
+            return
 
-    def on_webview_reload(self):
+        self.page_loading = False
         if self.page_changed:
             self.page_changed = False
             self.update_editor()
-            return
-        self.file_manager.update_css()
-        self.temporary_changes = False
+
+        self.prefetch_pages()
 
     def next_page(self):
         self.show_page(self.current_page_nr + 1)
@@ -409,11 +464,69 @@ class MainWindow(QMainWindow):
     def prev_page(self):
         self.show_page(self.current_page_nr - 1)
 
+    def next_style_page(self):
+        style_name = self.get_current_style_name()
+        if style_name == "":
+            return
+
+        # Index is being built, or selector can not be matched
+        if self.file_manager.get_style_match_count(style_name) is None:
+            self.statusBar().showMessage(f"Pages using {style_name} are not known", 5000)
+            return
+
+        page_nr = self.file_manager.get_next_page_using_style(style_name, self.current_page_nr)
+        if page_nr is None:
+            self.statusBar().showMessage(f"No other page uses {style_name}", 5000)
+        elif page_nr != self.current_page_nr:
+            self.show_page(page_nr)
+
+    def show_style_match_count(self):
+        style_name = self.get_current_style_name()
+        match_count = self.file_manager.get_style_match_count(style_name)
+        if style_name == "" or match_count is None:
+            return
+
+        elements, pages = match_count
+        self.statusBar().showMessage(f"{style_name}: {elements} elements on {pages} of "
+                                     f"{self.file_manager.get_page_count()} pages")
+
     def show_page(self, page_nr):
-        self.page_changed = True
-        self.current_page_nr, self.shown_url = self.file_manager.get_page(page_nr)
-        if self.shown_url is not None:
+        self.current_page_nr, page_name = self.file_manager.get_page(page_nr)
+        if page_name is None:
+            return
+
+        url = QUrl(get_book_url(page_name))
+        page = self.page_pool.take(url)
+        if page is None:
+            self.page_changed = True
+            self.shown_page_name = page_name
+            self.shown_url = url
             self.webview.load(self.shown_url)
+            return
+
+        # Prefetched page is swapped in, the shown one is kept for going back
+        shown_page = self.webview.page()
+        if self.page_loading:
+            shown_page.setParent(self.page_pool)
+            shown_page.deleteLater()
+        else:
+            self.page_pool.put(shown_page, self.shown_url, self.file_manager.get_member_size(self.shown_page_name))
+        self.webview.setPage(page)
+        self.page_loading = False
+        self.shown_page_name = page_name
+        self.shown_url = url
+
+        self.update_editor()
+        self.prefetch_pages()
+
+    # Loads the pages next to the shown one off-screen
+    def prefetch_pages(self):
+        urls_and_sizes = []
+        for page_nr in (self.current_page_nr + 1, self.current_page_nr - 1):
+            page_nr, page_name = self.file_manager.get_page(page_nr)
+            if page_nr != self.current_page_nr:
+                urls_and_sizes.append((QUrl(get_book_url(page_name)), self.file_manager.get_member_size(page_name)))
+        self.page_pool.prefetch(urls_and_sizes)
 
     # Returns 0 if succeeded, otherwise a positive number indicating an error
     def editor_set_file(self, relative_path, force=False):
@@ -458,44 +571,99 @@ class MainWindow(QMainWindow):
         if not file_path.suffix == '.epub':
             return
 
-        result = self.file_manager.load_book(file_path)
+        self.wait_for_save()
+        self.wait_for_load()
+
+        # Previous book is closed here, the preview may still be reading it
+        self.refresh_scheduler.cancel()
+        self.page_pool.clear()
+        self.shown_page_name = None
+        self.file_manager.close_book()
+
+        # Book is loaded in the background, first page is shown as soon as
+        # structure of the book is known, styles and fonts follow later
+        load_thread = LoadThread(self.file_manager, file_path, self)
+        load_thread.book_opened.connect(lambda result: self.on_book_opened(load_thread, result))
+        load_thread.stylesheets_loaded.connect(lambda: self.on_stylesheets_loaded(load_thread))
+        load_thread.fonts_found.connect(lambda font_names: self.on_fonts_found(load_thread, font_names))
+        load_thread.selectors_indexed.connect(lambda index: self.on_selectors_indexed(load_thread, index))
+        load_thread.load_failed.connect(lambda error: self.on_load_failed(load_thread, error))
+        self.load_thread = load_thread
+        load_thread.start()
+
+    # Signals of a thread, which has been waited for, may still arrive
+    # after a newer one has started, they are ignored
+    def on_book_opened(self, load_thread, result):
+        if load_thread is not self.load_thread:
+            return
+
         if result > 0:
+            self.load_thread = None
             self.file_close()
             self.file_open_error()
             return
 
         self.editor_set_file(None)  # Need to select a CSS file
 
-        self.import_fonts_from_book()
-
         self.combo_box_style.clear()
         self.editor_combo_box_file.clear()
+
+        self.page_pool.clear()
+        self.show_page(0)
+
+    def on_stylesheets_loaded(self, load_thread):
+        if load_thread is not self.load_thread:
+            return
+
         self.combo_box_style.addItems(self.file_manager.get_css_style_names())
         self.editor_combo_box_file.addItems(self.file_manager.get_css_file_paths())
 
-        self.show_page(0)
+    def on_fonts_found(self, load_thread, font_names):
+        if load_thread is not self.load_thread:
+            return
 
-    def import_fonts_from_book(self):
-        css_font_list = self.file_manager.get_css_font_name_list()
-        css_font_list.extend(self.file_manager.get_used_font_name_list())
+        self.import_fonts_from_book(font_names)
 
-        for font_name in css_font_list:
-            if '"' in font_name or '"' in font_name:
-                font_name = font_name[1:-1]
+    def on_selectors_indexed(self, load_thread, selector_index):
+        if load_thread is not self.load_thread:
+            return
+        self.load_thread = None
+        if selector_index is None:  # Book can be edited without it
+            return
 
-            font = Font.get_font_from_css_string(font_name)
-            font.file_type = Font.TYPE_FROM_EPUB
+        # Styles edited in the meantime are matched now
+        selector_index.update(self.file_manager.style_index.keys())
+        self.file_manager.selector_index = selector_index
+        self.show_style_match_count()
 
-            found = False
-            for font_2 in list(self.fonts.values()):
-                if font_2.name == font.name:
-                    found = True
-                    break
+    # Book has been opened, but its stylesheets could not be loaded
+    def on_load_failed(self, load_thread, error):
+        if load_thread is not self.load_thread:
+            return
+        self.load_thread = None
 
-            if not found:
-                self.fonts[str(font)] = font
+        self.file_manager.close_book()
+        self.file_close()
+        self.display_prompt("Error", f"ERROR - could not open file.\n\n{error}", QMessageBox.Ok)
 
-        self.update_font_list()
+    # Blocks until the book being loaded is ready, its signals are still delivered
+    def wait_for_load(self):
+        if self.load_thread is not None:
+            self.load_thread.wait()
+
+    def import_fonts_from_book(self, css_font_list=None):
+        if css_font_list is None:
+            css_font_list = self.file_manager.get_css_font_name_list()
+            css_font_list.extend(self.file_manager.get_used_font_name_list())
+
+        fonts = []
+        for font_name in css_font_list:
+            font = Font.get_font_from_css_string(font_name)
+            font.file_type = Font.TYPE_FROM_EPUB
+            fonts.append(font)
+
+        # Font list is updated by on_fonts_added
+        self.fonts.add_fonts(fonts, unique_name=True)
 
     def file_open_error(self):
         self.display_prompt("Error", "ERROR - could not open file. Not a valid EPUB.", QMessageBox.Ok)
@@ -530,19 +698,61 @@ class MainWindow(QMainWindow):
         if not self.file_manager.is_file_loaded():
             return
 
-        self.file_manager.save_book(QFileDialog.getSaveFileName(self, 'Save Epub', '', 'Epub Files (*.epub)')[0])
+        if self.save_thread is not None:
+            self.display_prompt("Save EPUB", "The book is still being saved", QMessageBox.Ok)
+            return
+
+        self.wait_for_load()
+
+        save_path = QFileDialog.getSaveFileName(self, 'Save Epub', '', 'Epub Files (*.epub)')[0]
+        if save_path == '':
+            return
+
+        # Preview shows the state being saved
+        self.refresh_scheduler.flush()
+
+        # Book is written in the background, from the state it has now
+        self.save_thread = SaveThread(self.file_manager.prepare_save(), save_path, self)
+        self.save_thread.progress.connect(self.on_save_progress)
+        self.save_thread.finished.connect(self.on_save_finished)
+        self.save_thread.start()
+
+    def on_save_progress(self, bytes_done, bytes_total, files_done, files_total):
+        self.statusBar().showMessage(f"Saving: {files_done}/{files_total} files, "
+                                     f"{bytes_done / 2 ** 20:.1f}/{bytes_total / 2 ** 20:.1f} MB")
+
+    def on_save_finished(self):
+        save_thread = self.save_thread
+        if save_thread is None:  # Already handled by wait_for_save
+            return
+        self.save_thread = None
+
+        if save_thread.error is not None:
+            print(f"Could not save file due to {save_thread.error}")
+            self.statusBar().showMessage("Saving failed")
+            self.display_prompt("Error", f"ERROR - could not save file.\n\n{save_thread.error}", QMessageBox.Ok)
+            return
+
+        result = self.file_manager.finish_save(save_thread.snapshot, save_thread.temp_path, save_thread.save_path)
+        if result > 0:
+            self.statusBar().showMessage("Saving failed")
+            return
+        self.statusBar().showMessage("File saved", 5000)
+
+    # Blocks until the book being saved is written
+    def wait_for_save(self):
+        if self.save_thread is not None:
+            self.save_thread.wait()
+            self.on_save_finished()
 
     def file_close(self):
+        self.refresh_scheduler.cancel()  # Book it would show is closed
+        self.page_pool.clear()
         self.reload_interface()
 
-    # Check the "fonts" folder for new fonts
-    def import_fonts(self):
-        results = list((Path(__file__).parent / "fonts").rglob("*.[tT][tT][fF]"))
-
-        for font_path in results:
-            font = Font(str(font_path), file_type=Font.TYPE_LOCAL_FILE)
-            if str(font) not in self.fonts:
-                self.fonts[str(font)] = font
+    # Check the "fonts" folder for new fonts, only new or changed files are read
+    def import_fonts(self, check_files=True):
+        self.fonts.add_fonts(self.font_catalogue.scan(check_files))
 
     def change_view(self):
         if self.left_panel.layout().currentIndex() == 0:
@@ -1,9 +1,10 @@
 from lxml import etree
 from pathlib import Path
-import io
-import random
 import datetime
 
+from book_container import BookContainer, resolve_href
+from xml_parsing import parse_xml
+
 NAMESPACES = {'XML': 'http://www.w3.org/XML/1998/namespace',
               'EPUB': 'http://www.idpf.org/2007/ops',
               'DAISY': 'http://www.daisy.org/z3986/2005/ncx/',
@@ -13,27 +14,182 @@ NAMESPACES = {'XML': 'http://www.w3.org/XML/1998/namespace',
               'XHTML': 'http://www.w3.org/1999/xhtml'}
 
 IMAGE_MEDIA_TYPES = ['image/jpeg', 'image/jpg', 'image/png', 'image/svg+xml']
+# Media types of formats that are compressed by themselves
+COMPRESSED_MEDIA_TYPES = [media_type for media_type in IMAGE_MEDIA_TYPES
+                          if media_type != 'image/svg+xml'] +\
+    ['image/gif', 'image/webp', 'font/woff', 'font/woff2',
+     'application/font-woff', 'audio/mpeg', 'audio/mp4', 'video/mp4']
 
 
 class MissingValueError(ValueError):
     pass
 
 
+class Manifest:
+    """
+    Items of the manifest of an OPF file, indexed by id, href and media type.
+    Items are added and removed through this object, so that the indexes
+    and the lxml tree stay in sync.\n
+    Hrefs are indexed by names of the files in the package they point to,
+    resolved from `opf_name`, so that differently written hrefs of
+    the same file (like "./a%20b.css" and "a b.css") match
+    """
+    ITEM_TAG = f'{{{NAMESPACES["OPF"]}}}item'
+
+    def __init__(self, element, opf_name: str = '') -> None:
+        self.element = element
+        self.opf_name = opf_name
+        self._by_id = dict()
+        # Name of the file in the package -> item
+        self._by_href = dict()
+        # Media type -> items, dictionary keeps order and allows fast removal
+        self._by_media_type = dict[str, dict]()
+        # Base of id -> the lowest number that might be free as its suffix
+        self._id_suffixes = dict[str, int]()
+        # (attribute, value) shared by more than one item
+        self._duplicates = set[tuple[str, str]]()
+        for item in element.iterfind(self.ITEM_TAG):
+            self._index(item)
+
+    def __len__(self) -> int:
+        return len(self._by_id)
+
+    def __iter__(self):
+        return self.element.iterfind(self.ITEM_TAG)
+
+    def get_by_id(self, item_id: str):
+        return self._by_id.get(item_id)
+
+    def get_by_href(self, href: str):
+        return self._by_href.get(self.get_name(href))
+
+    def get_by_name(self, name: str):
+        """
+        Returns item of the file with `name` in the package, or `None`
+        """
+        return self._by_href.get(name)
+
+    def get_name(self, href: str) -> str:
+        """
+        Returns name of the file in the package `href` points to,
+        or `href` itself if it points outside of the package
+        """
+        name = resolve_href(self.opf_name, href)
+        return href if name is None else name
+
+    def get_by_media_type(self, media_type: str) -> list:
+        return list(self._by_media_type.get(media_type, ()))
+
+    def generate_id(self, base_id: str) -> str:
+        """
+        Returns `base_id` or, if it is taken, `base_id` with the lowest
+        numeric suffix not tried for it before
+        """
+        if base_id not in self._by_id:
+            return base_id
+        suffix = self._id_suffixes.get(base_id, 1)
+        while f'{base_id}_{suffix}' in self._by_id:
+            suffix += 1
+        self._id_suffixes[base_id] = suffix + 1
+        return f'{base_id}_{suffix}'
+
+    def add(self, item_id: str, href: str, media_type: str):
+        """
+        Adds item with a free id based on `item_id` and returns it,
+        or `None` if there already is an item with `href`
+        """
+        return self.add_items([(item_id, href, media_type)])[0]
+
+    def add_items(self, items: list[tuple[str, str, str]]) -> list:
+        """
+        Adds (id, href, media type) items, see `add`
+        """
+        added = []
+        for item_id, href, media_type in items:
+            if self.get_name(href) in self._by_href:
+                added.append(None)
+                continue
+            item = self.element.makeelement(
+                self.ITEM_TAG, attrib={'id': self.generate_id(item_id),
+                                       'href': href,
+                                       'media-type': media_type})
+            if len(self.element) > 0:
+                item.tail = self.element[-1].tail
+                self.element[-1].tail = self.element.text
+            self.element.append(item)
+            self._index(item)
+            added.append(item)
+        return added
+
+    def remove(self, item) -> None:
+        self.remove_items([item])
+
+    def remove_items(self, items: list) -> None:
+        for item in items:
+            if item is self.element[-1] and len(self.element) > 1:
+                self.element[-2].tail = item.tail
+            self.element.remove(item)
+            self._unindex(item)
+
+    def _get_key(self, item, attribute: str) -> str:
+        if attribute == 'href':
+            return self.get_name(item.get('href', ''))
+        return item.get(attribute)
+
+    def _index(self, item) -> None:
+        for index, attribute in ((self._by_id, 'id'), (self._by_href, 'href')):
+            key = self._get_key(item, attribute)
+            if index.setdefault(key, item) is not item:
+                # Invalid, but found in books, the first item is indexed
+                self._duplicates.add((attribute, key))
+        self._by_media_type.setdefault(item.get('media-type'), {})[item] = None
+
+    def _unindex(self, item) -> None:
+        for index, attribute in ((self._by_id, 'id'), (self._by_href, 'href')):
+            key = self._get_key(item, attribute)
+            if index.get(key) is not item:
+                continue
+            del index[key]
+            if (attribute, key) in self._duplicates:
+                for other in self:
+                    if self._get_key(other, attribute) == key:
+                        self._index(other)
+                        break
+        items = self._by_media_type.get(item.get('media-type'), {})
+        items.pop(item, None)
+        if len(items) == 0:
+            self._by_media_type.pop(item.get('media-type'), None)
+
+
 class Pathfinder:
     """
     Object finding paths to stylesheets and files in the spine of
     the unpacked .epub file
     """
-    def __init__(self, book_dir: str = None) -> None:
+    def __init__(self, book_dir: str = None,
+                 container: BookContainer = None) -> None:
         self._rendition = (-1,
                            {'spine': list[str](),
                             'stylesheets': list[str]()},
                            None)
         self._opf_files = list[str]()
-        self.set_book_dir(book_dir=book_dir)
-
-    def set_book_dir(self, book_dir: str = None) -> None:
+        # Index of rendition -> (spine, stylesheets, tree, manifest),
+        # every OPF file is parsed once, later its tree is edited in place
+        self._opf_cache = dict[int, tuple[list[str], list[str], None, Manifest]]()
+        # Indexes of renditions whose trees were edited after being written
+        self._dirty_opf_files = set[int]()
+        self.set_book_dir(book_dir=book_dir, container=container)
+
+    def set_book_dir(self, book_dir: str = None,
+                     container: BookContainer = None) -> None:
+        """
+        Files are read through `container`, if none is given they are read
+        directly from `book_dir`
+        """
         self.book_dir = book_dir
+        if container is None and book_dir is not None:
+            container = BookContainer(book_dir)
+        self.container = container
 
     def find_renditions(self) -> None:
         self._rendition = (-1,
@@ -41,6 +197,8 @@ class Pathfinder:
                             'stylesheets': list[str]()},
                            None)
         self._opf_files.clear()
+        self._opf_cache.clear()
+        self._dirty_opf_files.clear()
         self._load_container()
 
     def load_rendition(self, index: int = 0) -> None:
@@ -76,30 +234,30 @@ class Pathfinder:
     def add_item_to_rendition_manifest(self, item_attributes:
                                        list[str, str, str]) -> bool:
         """
-        Works if `item_attributes[0]` is unique id and `item_attributes[1]`
-        refers to a file not added to manifest already
+        Works if `item_attributes[1]` refers to a file not added to manifest
+        already. If `item_attributes[0]` is not a unique id, a suffix is
+        added to it. Returns `False` or tuple: (id, path) of the added item
         """
-        item_id, item_path, item_media_type = item_attributes
-        opf_file_path, _, _, opf_file_tree = self._get_rendition_data()
-        manifest = opf_file_tree.find(f'{{{NAMESPACES["OPF"]}}}manifest')
-        opf_file_path = Path(self.book_dir) / opf_file_path
-        opf_file_dirname = opf_file_path.parent
-        item_href = Path(item_path).relative_to(opf_file_dirname)
-        if manifest.find(f'{{{NAMESPACES["OPF"]}}}item[@href="{item_href}"]')\
-           is not None:  # file already added
-            return False
-
-        item_id =\
-            self._generate_not_present_id(manifest, item_id)
-        item = manifest.makeelement(f'{{{NAMESPACES["OPF"]}}}item',
-                                    attrib={'id': item_id,
-                                            'href': str(item_href),
-                                            'media-type': item_media_type})
-        item.tail = manifest[-1].tail
-        manifest[-1].tail = manifest.text
-        manifest.extend([item])
-
-        return item_id, item_path
+        return self.add_items_to_rendition_manifest([item_attributes])[0]
+
+    def add_items_to_rendition_manifest(self, items_attributes:
+                                        list[list[str, str, str]]) -> list:
+        """
+        Adds (id, path, media type) items at once,
+        see `add_item_to_rendition_manifest`
+        """
+        opf_file_dirname = (Path(self.book_dir) /
+                            self.get_opf_file_path()).parent
+        manifest = self._get_manifest(self._rendition[0])
+        items = manifest.add_items(
+            [(item_id, Path(item_path).relative_to(opf_file_dirname).as_posix(),
+              item_media_type)
+             for item_id, item_path, item_media_type in items_attributes])
+        if any(item is not None for item in items):
+            self._dirty_opf_files.add(self._rendition[0])
+
+        return [(item.get('id'), item_path) if item is not None else False
+                for item, (_, item_path, _) in zip(items, items_attributes)]
 
     def remove_item_from_rendition_manifest(
             self, ids: tuple[str, str] = (None, None)) -> tuple[bool, bool]:
@@ -110,53 +268,67 @@ class Pathfinder:
         second - if file itself can be removed because it is not mentioned
         in manifests of other renditions
         """
-        item_id, item_path = ids
-        if item_id is None and item_path is None:
-            return False, False
-        opf_file_path, _, _, opf_file_tree = self._get_rendition_data()
-        manifest = opf_file_tree.find(f'{{{NAMESPACES["OPF"]}}}manifest')
-        if len(manifest) <= 2:  # at least 1 item in manifest at all times
-            return False, False
-        opf_file_path = Path(self.book_dir) / opf_file_path
-        opf_file_dirname = opf_file_path.parent
-        item_href = item_path
-        if item_href is not None:
-            item_href = Path(item_href).relative_to(opf_file_dirname)
-
-        if item_id is not None and item_href is not None:
-            ids = manifest.findall(f'{{{NAMESPACES["OPF"]}}}item\
-[@id="{item_id}"]')
-            hrefs = manifest.findall(f'{{{NAMESPACES["OPF"]}}}item\
-[@href="{item_href}"]')
-            matches = list(set(ids) & set(hrefs))
-        elif item_id is not None:
-            matches = manifest.findall(f'{{{NAMESPACES["OPF"]}}}item\
-[@id="{item_id}"]')
-        else:
-            matches = manifest.findall(f'{{{NAMESPACES["OPF"]}}}item\
-[@href="{item_href}"]')
-        if len(matches) != 1:
-            return False, False
-
-        match = matches[0]
-        if match == manifest[-1]:
-            manifest[-2].tail = manifest[-1].tail
-        item_path = Path(opf_file_dirname) / match.get('href')
-        manifest.remove(match)
-
-        for i in range(len(self._opf_files)):
-            if i == self._rendition[0]:
+        return self.remove_items_from_rendition_manifest([ids])[0]
+
+    def remove_items_from_rendition_manifest(
+            self, ids_list: list[tuple[str, str]]) -> list[tuple[bool, bool]]:
+        """
+        Removes items matching (id, path) tuples at once,
+        see `remove_item_from_rendition_manifest`
+        """
+        opf_file_dirname = (Path(self.book_dir) /
+                            self.get_opf_file_path()).parent
+        manifest = self._get_manifest(self._rendition[0])
+        results = []
+        for item_id, item_path in ids_list:
+            # at least 1 item in manifest at all times
+            if len(manifest.element) <= 2:
+                results.append((False, False))
+                continue
+            match = self._find_manifest_item(manifest, opf_file_dirname,
+                                             item_id, item_path)
+            if match is None:
+                results.append((False, False))
                 continue
-            if self._is_file_in_rendition_manifest(item_path, i):
-                return True, False
-        return True, True
+
+            manifest.remove(match)
+            self._dirty_opf_files.add(self._rendition[0])
+            item_path = opf_file_dirname / match.get('href')
+            in_other_renditions = any(
+                self._is_file_in_rendition_manifest(item_path, i)
+                for i in range(len(self._opf_files))
+                if i != self._rendition[0])
+            results.append((True, not in_other_renditions))
+        return results
+
+    @staticmethod
+    def _find_manifest_item(manifest: Manifest, opf_file_dirname: Path,
+                            item_id: str, item_path: str):
+        item_href = None
+        if item_path is not None:
+            item_href = Path(item_path).relative_to(opf_file_dirname).as_posix()
+
+        if item_id is not None:
+            item = manifest.get_by_id(item_id)
+            if item is not None and item_href is not None and\
+               manifest.get_name(item.get('href', '')) != manifest.get_name(item_href):
+                return None
+            return item
+        if item_href is not None:
+            return manifest.get_by_href(item_href)
+        return None
 
     def save_rendition_file(self):
+        """
+        Writes OPF file of the loaded rendition if it was edited since it was
+        read or last written, marking the time of modification in it
+        """
         try:
             opf_file_path, _, _, opf_file_tree = self._get_rendition_data()
         except RuntimeError:
             return
-        opf_file_path = self.book_dir / opf_file_path
+        if not self.is_rendition_file_dirty():
+            return
         metadata = opf_file_tree.find(f'{{{NAMESPACES["OPF"]}}}metadata')
         last_edited =\
             metadata.find(f'{{{NAMESPACES["OPF"]}}}meta[@property="dcterms:modified"]')
@@ -167,37 +339,69 @@ class Pathfinder:
             last_edited.tail = metadata[-1].tail
             metadata[-1].tail = metadata.text
             metadata.extend([last_edited])
-        now = datetime.datetime.now().strftime("%Y-%m-%dT%H:%M:%SZ")
+        now = datetime.datetime.now(datetime.timezone.utc)\
+            .strftime("%Y-%m-%dT%H:%M:%SZ")
         last_edited.text = str(now)
         serialized = etree.tostring(opf_file_tree, encoding='utf-8',
                                     xml_declaration=True)
-        with open(opf_file_path, 'wb') as file:
-            file.write(serialized)
+        self.container.write(opf_file_path, serialized)
+        self._dirty_opf_files.discard(self._rendition[0])
 
-    def _generate_not_present_id(self, manifest, base_id: str) -> str:
-        # Very simple id generation. Replace with something decent if need be
-        new_id = base_id
-        while manifest.find(f'{{{NAMESPACES["OPF"]}}}item[@id="{new_id}"]')\
-                is not None:
-            new_id += str(random.randint(0, 9))
-        return new_id
+    def is_rendition_file_dirty(self, rendition_id: int = None) -> bool:
+        """
+        Returns `True` if manifest of the rendition (by default the loaded
+        one) was edited since it was last written
+        """
+        if rendition_id is None:
+            rendition_id = self._rendition[0]
+        return rendition_id in self._dirty_opf_files
 
     def _is_file_in_rendition_manifest(self, filepath: str,
                                        rendition_id: int) -> bool:
-        _, _, rendition_tree = self._load_opf_file(rendition_id)
         rendition_rel_path = self._opf_files[rendition_id]
         opf_file_dirname = (Path(self.book_dir) / rendition_rel_path).parent
         href = Path(filepath).relative_to(opf_file_dirname)
-        manifest = rendition_tree.find(f'{{{NAMESPACES["OPF"]}}}manifest')
-        if manifest.find(f'{{{NAMESPACES["OPF"]}}}item[@href="{href}"]')\
-           is not None:
-            return True
-        return False
+        return self._get_manifest(rendition_id).get_by_href(href.as_posix())\
+            is not None
+
+    def _get_manifest(self, rendition_id: int) -> Manifest:
+        if rendition_id < 0:
+            raise IndexError(f'There is no rendition {rendition_id}')
+        self._load_opf_file(rendition_id)
+        return self._opf_cache[rendition_id][3]
+
+    def get_rendition_media_types(self) -> dict[str, str]:
+        """
+        Returns dictionary: name of a file in the package -> its media type,
+        for every item in manifest of the loaded rendition, empty if none
+        is loaded
+        """
+        if self._rendition[0] == -1:
+            return {}
+        opf_file_path = self.get_opf_file_path()
+        media_types = dict[str, str]()
+        for item in self._get_manifest(self._rendition[0]):
+            name = resolve_href(opf_file_path.as_posix(), item.get('href', ''))
+            if name is not None and item.get('media-type') is not None:
+                media_types[name] = item.get('media-type')
+        return media_types
+
+    def get_media_type(self, name: str) -> str:
+        """
+        Returns media type of the file from the package, as given in
+        manifest of the loaded rendition, or `None` if it is not listed
+        or no rendition is loaded
+        """
+        if self._rendition[0] == -1:
+            return None
+        item = self._get_manifest(self._rendition[0]).get_by_name(name)
+        if item is None:
+            return None
+        return item.get('media-type')
 
     def get_rendition_manifest_items_attributes(self, rendition_id: int = 0)\
             -> list[tuple[str, str, str]]:
-        content = self._read(self.renditions[rendition_id]['opf_file'])
-        tree = self._parse_xml(content)
+        _, _, tree = self._load_opf_file(rendition_id)
         manifest = tree.find(f'{{{NAMESPACES["OPF"]}}}manifest')
         children = manifest.getchildren()
         attributes =\
@@ -205,13 +409,8 @@ class Pathfinder:
              for child in children]
         return attributes
 
-    def _parse_xml(self, xml: str) -> None:
-        try:
-            tree = etree.parse(io.BytesIO(xml.encode('utf-8')))
-        except etree.Error:
-            tree = etree.parse(io.BytesIO(xml))
-
-        return tree
+    def _parse_xml(self, xml: bytes):
+        return parse_xml(xml)
 
     def _get_rendition_data(self):
         if self._rendition[0] == -1:
@@ -246,13 +445,18 @@ and therefore book cannot be read')
 in \"META-INF/container.xml\" is marked with proper media-type and therefore, \
 file is non-compliant with the standard')
 
-    def _read(self, name: str) -> str:
-        with open(Path(self.book_dir) / name, "r") as file:
-            content = file.read()
-        return content
+    def _read(self, name: str) -> bytes:
+        return self.container.read(name)
 
     def _load_opf_file(self, opf_file_index: int)\
             -> tuple[list[str], list[str], None]:
+        """
+        Returns spine, stylesheets and tree of the OPF file, which is read
+        and parsed only the first time
+        """
+        if opf_file_index in self._opf_cache:
+            return self._opf_cache[opf_file_index][:3]
+
         opf_file_internal_path = self._opf_files[opf_file_index]
         try:
             content = self._read(opf_file_internal_path)
@@ -264,6 +468,10 @@ file is non-compliant with the standard')
         id_to_href, stylesheets = self._load_manifest(opf_file_tree)
         spine = self._load_spine(opf_file_tree, id_to_href)
 
+        self._opf_cache[opf_file_index] =\
+            (spine, stylesheets, opf_file_tree,
+             Manifest(opf_file_tree.find(f'{{{NAMESPACES["OPF"]}}}manifest'),
+                      opf_file_internal_path))
         return spine, stylesheets, opf_file_tree
 
     def _load_manifest(self, container) -> tuple[dict[str, str], list[str]]:
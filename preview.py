@@ -0,0 +1,115 @@
+"""
+Scripts changing the page shown in the preview without reloading it,
+and scheduling of preview refreshes
+"""
+import json
+from urllib.parse import quote
+
+from PySide6.QtCore import QObject, QTimer
+
+# Files of the opened book are served to the preview under this scheme
+BOOK_SCHEME = 'epub'
+
+# One frame at 60 Hz
+REFRESH_INTERVAL = 16
+
+# Replaces declarations of the first top-level rule with given selector,
+# in the stylesheet loaded from given url. Evaluates to:
+# true - rule updated, false - stylesheet found but rule not,
+# null - page does not use the stylesheet
+RULE_UPDATE_SCRIPT = '''(function (sheetUrl, selector, declarations) {
+    const url = new URL(sheetUrl).href;
+    let found = null;
+    for (const sheet of document.styleSheets) {
+        if (sheet.href === null || new URL(sheet.href).href !== url) {
+            continue;
+        }
+        found = false;
+        for (const rule of sheet.cssRules) {
+            if (rule.type === CSSRule.STYLE_RULE && rule.selectorText === selector) {
+                rule.style.cssText = declarations;
+                found = true;
+                break;
+            }
+        }
+    }
+    return found;
+})(%s, %s, %s)'''
+
+# Sets the text of the highlight overlay, a stylesheet added to the shown
+# page only, so that stylesheets of the book stay untouched.
+# Empty text removes the overlay
+HIGHLIGHT_SCRIPT = '''(function (css) {
+    const id = 'epub-editor-highlight';
+    let overlay = document.getElementById(id);
+    if (css === '') {
+        if (overlay !== null) {
+            overlay.remove();
+        }
+        return;
+    }
+    if (overlay === null) {
+        overlay = document.createElementNS('http://www.w3.org/1999/xhtml', 'style');
+        overlay.id = id;
+        (document.head || document.documentElement).appendChild(overlay);
+    }
+    overlay.textContent = css;
+})(%s)'''
+
+
+def get_book_url(name: str) -> str:
+    """
+    Returns url of the file from the book, `name` relative to its root
+    """
+    return f'{BOOK_SCHEME}:/{quote(name)}'
+
+
+def build_rule_update_script(css_name: str, selector: str,
+                             declarations: str) -> str:
+    return RULE_UPDATE_SCRIPT % (json.dumps(get_book_url(css_name)),
+                                 json.dumps(selector),
+                                 json.dumps(declarations))
+
+
+def build_highlight_script(selector: str, color: str) -> str:
+    """
+    Returns script highlighting elements matched by `selector` with
+    background `color`, or removing the highlight if `selector` is empty
+    """
+    css = ''
+    if selector != '':
+        css = f'{selector} {{ background-color: {color} !important; }}'
+    return HIGHLIGHT_SCRIPT % json.dumps(css)
+
+
+class RefreshScheduler(QObject):
+    """
+    Merges refresh requests made within `interval` milliseconds into one
+    call of `refresh`, which is made after the last of them, so that it
+    shows the latest state
+    """
+    def __init__(self, refresh, interval: int = REFRESH_INTERVAL,
+                 parent: QObject = None) -> None:
+        super().__init__(parent)
+        self.refresh = refresh
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(interval)
+        self.timer.timeout.connect(self.refresh)
+
+    def schedule(self) -> None:
+        # Started timer is not restarted, so that continuous edits
+        # (slider drags) are still shown once per interval
+        if not self.timer.isActive():
+            self.timer.start()
+
+    def flush(self) -> None:
+        """
+        Makes the pending refresh immediately
+        """
+        if self.timer.isActive():
+            self.timer.stop()
+            self.refresh()
+
+    def cancel(self) -> None:
+        self.timer.stop()
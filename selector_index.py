@@ -0,0 +1,99 @@
+"""
+Index of pages of the book, on which selectors of styles match elements.\n
+Matching selectors needs the optional cssselect package, without it
+the index is empty
+"""
+from lxml import etree
+
+from xml_parsing import parse_xml
+
+try:
+    from cssselect import ExpressionError, HTMLTranslator, SelectorError, parse
+except ImportError:
+    parse = None
+
+
+def parse_page(data: bytes):
+    """
+    Returns root element of the page with namespaces removed from names
+    of elements, so that selectors without namespaces match them,
+    or `None` if page could not be parsed
+    """
+    try:
+        root = parse_xml(data, recover=True).getroot()
+    except (etree.Error, ValueError):
+        return None
+    for element in root.iter(etree.Element):
+        element.tag = etree.QName(element).localname
+    return root
+
+
+class SelectorIndex:
+    """
+    Selector -> number of elements it matches on each page of the spine.\n
+    Pages are parsed only once, so that selectors can be added later
+    """
+    def __init__(self, pages: list) -> None:
+        # Root elements of the pages, `None` for pages that are not valid
+        self.pages = pages
+        self.matches = dict[str, list[int]]()
+        self.translator = HTMLTranslator(xhtml=True) if parse else None
+
+    @classmethod
+    def from_documents(cls, documents: list[bytes]) -> 'SelectorIndex':
+        return cls([parse_page(document) for document in documents])
+
+    @staticmethod
+    def is_available() -> bool:
+        return parse is not None
+
+    def update(self, selectors) -> None:
+        """
+        Matches selectors which are not indexed yet and removes the ones
+        which are not in `selectors` anymore
+        """
+        selectors = set(selectors)
+        for selector in list(self.matches):
+            if selector not in selectors:
+                del self.matches[selector]
+        for selector in selectors:
+            if selector not in self.matches:
+                self.matches[selector] = self._match(selector)
+
+    def get_match_count(self, selector: str) -> tuple[int, int]:
+        """
+        Returns tuple: (number of matched elements, number of pages with
+        them), or `None` if selector is not indexed or can not be matched
+        """
+        counts = self.matches.get(selector)
+        if counts is None:
+            return None
+        return sum(counts), sum(1 for count in counts if count > 0)
+
+    def get_next_page(self, selector: str, page_nr: int) -> int:
+        """
+        Returns number of the first page after `page_nr` with elements
+        matched by selector, wrapping to the first page, or `None`
+        """
+        counts = self.matches.get(selector)
+        if counts is None:
+            return None
+        for offset in range(1, len(counts) + 1):
+            next_page_nr = (page_nr + offset) % len(counts)
+            if counts[next_page_nr] > 0:
+                return next_page_nr
+        return None
+
+    def _match(self, selector: str) -> list[int]:
+        # Pseudo-elements are matched by their elements, dynamic
+        # pseudo-classes (like :hover) never match
+        if parse is None:
+            return None
+        try:
+            xpath = etree.XPath(' | '.join(
+                self.translator.selector_to_xpath(parsed)
+                for parsed in parse(selector)))
+        except (SelectorError, ExpressionError, etree.XPathError):
+            return None
+        return [0 if root is None else len(xpath(root))
+                for root in self.pages]
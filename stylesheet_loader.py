@@ -0,0 +1,192 @@
+import copyreg
+import hashlib
+import multiprocessing
+import os
+import pickle
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from importlib import metadata
+from pathlib import Path
+from pickle import PicklingError
+
+import cssutils
+from cssutils.css import CSSRuleList
+
+# Books with less CSS than this are parsed in the main process, because
+# starting worker processes would take longer than parsing itself
+PARALLEL_PARSING_MIN_SIZE = 256 * 1024
+STYLESHEET_CACHE_MAX_SIZE = 256 * 1024 * 1024
+
+
+def _rebuild_rule_list(rules, state):
+    rule_list = CSSRuleList()
+    list.extend(rule_list, rules)
+    rule_list.__dict__.update(state)
+    return rule_list
+
+
+def _reduce_rule_list(rule_list):
+    return _rebuild_rule_list, (list(rule_list), rule_list.__dict__)
+
+
+# CSSRuleList forbids append(), which pickle uses to restore list subclasses,
+# so parsed stylesheets can not be sent between processes without this
+copyreg.pickle(CSSRuleList, _reduce_rule_list)
+
+
+def _get_cache_format() -> str:
+    try:
+        cssutils_version = metadata.version('cssutils')
+    except metadata.PackageNotFoundError:
+        cssutils_version = 'unknown'
+    return f'py{sys.version_info[0]}.{sys.version_info[1]}-\
+cssutils{cssutils_version}-pickle{pickle.HIGHEST_PROTOCOL}'
+
+
+class StylesheetCache:
+    """
+    On-disk cache of parsed stylesheets, keyed by SHA-256 of their bytes.\n
+    Sheets are stored pickled, which is several times faster to restore
+    than parsing. Least recently used entries are removed once the cache
+    grows over `max_size` bytes
+    """
+    def __init__(self, cache_dir: str,
+                 max_size: int = STYLESHEET_CACHE_MAX_SIZE) -> None:
+        # Pickles are only readable by the same versions of the libraries
+        self.cache_dir = Path(cache_dir) / _get_cache_format()
+        self.max_size = max_size
+        self._size = None
+
+    @staticmethod
+    def get_key(css_bytes: bytes) -> str:
+        return hashlib.sha256(css_bytes).hexdigest()
+
+    def get(self, key: str, href: str = None):
+        """
+        Returns cached stylesheet or `None` if there is none
+        """
+        path = self._get_path(key)
+        try:
+            with open(path, 'rb') as file:
+                sheet = pickle.loads(file.read())
+            os.utime(path)  # Modification time marks the last use
+        except FileNotFoundError:
+            return None
+        except (OSError, pickle.UnpicklingError, EOFError,
+                AttributeError, ImportError) as e:
+            print(f"Could not read cached stylesheet due to {e}")
+            self._remove(path)
+            return None
+        # The same stylesheet may have been cached from another book
+        sheet._href = href
+        return sheet
+
+    def put(self, key: str, pickled_sheet: bytes) -> None:
+        path = self._get_path(key)
+        temp_path = path.with_name(path.name + f'.{os.getpid()}.tmp')
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(temp_path, 'wb') as file:
+                file.write(pickled_sheet)
+            os.replace(temp_path, path)
+        except OSError as e:
+            print(f"Could not cache stylesheet due to {e}")
+            self._remove(temp_path)
+            return
+        if self._size is not None:
+            self._size += len(pickled_sheet)
+        self.trim()
+
+    def trim(self) -> None:
+        """
+        Removes least recently used entries until cache fits in `max_size`
+        """
+        if self._size is not None and self._size <= self.max_size:
+            return
+        entries = []
+        try:
+            with os.scandir(self.cache_dir) as scanned:
+                for entry in scanned:
+                    if entry.is_file() and entry.name.endswith('.pickle'):
+                        stat = entry.stat()
+                        entries.append((stat.st_mtime, stat.st_size,
+                                        Path(entry.path)))
+        except FileNotFoundError:
+            pass
+        self._size = sum(size for _, size, _ in entries)
+        entries.sort()
+        for _, size, path in entries:
+            if self._size <= self.max_size:
+                break
+            self._remove(path)
+            self._size -= size
+
+    def _get_path(self, key: str) -> Path:
+        return self.cache_dir / f'{key}.pickle'
+
+    @staticmethod
+    def _remove(path: Path) -> None:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def parse_stylesheet(css_bytes: bytes, href: str = None):
+    return cssutils.parseString(css_bytes, href=href)
+
+
+def _parse_pickled_stylesheet(css_bytes: bytes, href: str = None) -> bytes:
+    # Pickled by the worker, so that the parent can cache the same bytes
+    return pickle.dumps(parse_stylesheet(css_bytes, href),
+                        pickle.HIGHEST_PROTOCOL)
+
+
+def parse_stylesheets(sources: list[tuple[bytes, str]],
+                      min_parallel_size: int = PARALLEL_PARSING_MIN_SIZE,
+                      cache: StylesheetCache = None) -> list:
+    """
+    Parses (css bytes, href) tuples and returns stylesheets in the same
+    order. Stylesheets found in `cache` are not parsed at all.
+    If there are at least two files and `min_parallel_size` bytes of CSS
+    left to parse, files are parsed across a process pool
+    """
+    sheets = [None] * len(sources)
+    keys = [None] * len(sources)
+    missing = []
+    for i, (css_bytes, href) in enumerate(sources):
+        if cache is not None:
+            keys[i] = cache.get_key(css_bytes)
+            sheets[i] = cache.get(keys[i], href)
+        if sheets[i] is None:
+            missing.append(i)
+
+    total_size = sum(len(sources[i][0]) for i in missing)
+    workers = min(len(missing), os.cpu_count() or 1)
+    pickled_sheets = None
+    if workers >= 2 and total_size >= min_parallel_size:
+        try:
+            # Forked children would inherit locks held by other threads,
+            # like the ones of Qt or of the thread loading the book
+            with ProcessPoolExecutor(max_workers=workers,
+                                     mp_context=multiprocessing.get_context('spawn')) as executor:
+                pickled_sheets = list(executor.map(
+                    _parse_pickled_stylesheet,
+                    *zip(*[sources[i] for i in missing])))
+        except (BrokenProcessPool, PicklingError, OSError) as e:
+            print(f"Parsing stylesheets in parallel failed due to {e}")
+
+    for n, i in enumerate(missing):
+        if pickled_sheets is not None:
+            sheets[i] = pickle.loads(pickled_sheets[n])
+        else:
+            sheets[i] = parse_stylesheet(*sources[i])
+        if cache is not None:
+            if pickled_sheets is not None:
+                pickled_sheet = pickled_sheets[n]
+            else:
+                pickled_sheet = pickle.dumps(sheets[i],
+                                             pickle.HIGHEST_PROTOCOL)
+            cache.put(keys[i], pickled_sheet)
+    return sheets
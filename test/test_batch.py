@@ -0,0 +1,69 @@
+import unittest
+import shutil
+import tempfile
+from pathlib import Path
+from batch import EDIT_EMBED_FONT, EDIT_REMOVE, EDIT_SET, find_books, parse_arguments, restyle_book
+from file_manager import FileManager
+
+
+class TestBatch(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.test_dir = Path(tempfile.mkdtemp())
+        self.book_path = Path('books/manual.epub')
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.test_dir)
+
+    def test_restyle_book(self) -> None:
+        output_path = self.test_dir / 'out' / 'manual.epub'
+        edits = [(EDIT_SET, 'p', 'color', 'red'),
+                 (EDIT_REMOVE, 'p', 'color'),
+                 (EDIT_SET, 'h1', 'color', 'blue')]
+
+        _, error = restyle_book(str(self.book_path), str(output_path), edits,
+                                self.test_dir / 'cache')
+        test_file_manager = FileManager(self.test_dir / 'edit', self.test_dir / 'cache')
+        test_file_manager.load_book(output_path)
+        p_color = test_file_manager.get_css_param('p', 'color')
+        h1_color = test_file_manager.get_css_param('h1', 'color')
+        test_file_manager.container.close()
+
+        self.assertIsNone(error)
+        self.assertEqual('', p_color)
+        self.assertEqual('blue', h1_color)
+
+    def test_restyle_book_missing_style(self) -> None:
+        output_path = self.test_dir / 'manual.epub'
+        edits = [(EDIT_SET, 'no-such-style', 'color', 'red')]
+
+        _, error = restyle_book(str(self.book_path), str(output_path), edits,
+                                self.test_dir / 'cache')
+
+        self.assertIn('no-such-style', error)
+        self.assertFalse(output_path.exists())
+
+    def test_parse_arguments_keeps_order_of_edits(self) -> None:
+        arguments = parse_arguments(['a.epub', '-o', 'out',
+                                     '--remove', 'p', 'color',
+                                     '--embed-font', 'h1', 'font.ttf',
+                                     '--set', 'p', 'color', 'red'])
+
+        self.assertListEqual([(EDIT_REMOVE, 'p', 'color'),
+                              (EDIT_EMBED_FONT, 'h1', 'font.ttf'),
+                              (EDIT_SET, 'p', 'color', 'red')],
+                             arguments.edits)
+        self.assertListEqual([], parse_arguments(['a.epub', '-o', 'out']).edits)
+
+    def test_find_books(self) -> None:
+        (self.test_dir / 'a').mkdir()
+        for name in ['a/1.epub', 'a/2.EPUB', 'a/3.txt', '4.epub']:
+            (self.test_dir / name).touch()
+
+        books = find_books([str(self.test_dir / '**' / '*.*'),
+                            str(self.test_dir / '4.epub')])
+
+        self.assertListEqual(
+            [self.test_dir / name for name in ['4.epub', 'a/1.epub',
+                                               'a/2.EPUB']],
+            books)
@@ -0,0 +1,179 @@
+import unittest
+from copy import copy
+import shutil
+import tempfile
+from pathlib import Path
+from zipfile import ZIP_DEFLATED, ZIP_STORED, ZipFile
+from book_container import BookContainer, resolve_href
+from compression_policy import CompressionPolicy
+
+
+class TestBookContainer(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.test_dir = Path(tempfile.mkdtemp())
+        self.book_path = self.test_dir / 'book.epub'
+        with ZipFile(self.book_path, 'w') as book:
+            book.writestr('mimetype', 'application/epub+zip')
+            book.writestr('OEBPS/style.css', 'p { color: red }')
+            book.writestr('OEBPS/image.png', b'\x89PNG')
+        self.edition_dir = self.test_dir / 'edit'
+        self.edition_dir.mkdir()
+        self.container = BookContainer(self.edition_dir)
+        self.container.open(self.book_path)
+
+    def tearDown(self) -> None:
+        self.container.close()
+        shutil.rmtree(self.test_dir)
+
+    def test_open_does_not_extract(self) -> None:
+        self.assertEqual(b'p { color: red }',
+                         self.container.read('OEBPS/style.css'))
+        self.assertListEqual([], list(self.edition_dir.iterdir()))
+
+    def test_write_only_writes_edited_member(self) -> None:
+        self.container.write(self.edition_dir / 'OEBPS/style.css', b'p {}')
+
+        self.assertEqual(b'p {}', self.container.read('OEBPS/style.css'))
+        self.assertTrue(self.container.is_modified('OEBPS/style.css'))
+        self.assertFalse((self.edition_dir / 'OEBPS/image.png').exists())
+
+    def test_get_size(self) -> None:
+        self.container.write('OEBPS/style.css', b'p {}')
+
+        self.assertEqual(4, self.container.get_size('OEBPS/image.png'))
+        self.assertEqual(4, self.container.get_size('OEBPS/style.css'))
+        self.assertFalse((self.edition_dir / 'OEBPS/image.png').exists())
+
+    def test_remove(self) -> None:
+        self.container.remove('OEBPS/image.png')
+
+        self.assertFalse(self.container.exists('OEBPS/image.png'))
+        self.assertNotIn('OEBPS/image.png', self.container.names())
+        with self.assertRaises(FileNotFoundError):
+            self.container.read('OEBPS/image.png')
+
+    def test_save_over_source(self) -> None:
+        self.container.write('OEBPS/style.css', b'p {}')
+        self.container.write('OEBPS/font.ttf', b'font')
+        self.container.save(self.book_path)
+
+        with ZipFile(self.book_path) as book:
+            self.assertListEqual(['mimetype', 'OEBPS/style.css',
+                                  'OEBPS/image.png', 'OEBPS/font.ttf'],
+                                 book.namelist())
+            self.assertEqual(b'p {}', book.read('OEBPS/style.css'))
+        self.assertFalse(self.container.is_modified('OEBPS/style.css'))
+        self.assertEqual(b'\x89PNG', self.container.read('OEBPS/image.png'))
+
+    def test_save_copies_unmodified_members_raw(self) -> None:
+        saved_path = self.test_dir / 'saved.epub'
+        self.container.write('OEBPS/style.css', b'p {}')
+        self.container.save(saved_path, policy=CompressionPolicy())
+
+        with ZipFile(saved_path) as book:
+            self.assertIsNone(book.testzip())
+            self.assertEqual(ZIP_STORED,
+                             book.getinfo('OEBPS/image.png').compress_type)
+            self.assertEqual(ZIP_DEFLATED,
+                             book.getinfo('OEBPS/style.css').compress_type)
+            self.assertEqual(b'\x89PNG', book.read('OEBPS/image.png'))
+            self.assertEqual(b'p {}', book.read('OEBPS/style.css'))
+
+    def test_save_applies_compression_policy(self) -> None:
+        saved_path = self.test_dir / 'saved.epub'
+        self.container.write('OEBPS/font.ttf', b'font')
+        media_types = {'OEBPS/font.ttf': 'application/x-font-ttf'}
+        policy = CompressionPolicy(stored_media_types=['text/css'],
+                                   levels={'application/x-font-ttf': 9})
+
+        self.container.save(saved_path, media_types, policy)
+
+        with ZipFile(saved_path) as book:
+            infos = book.infolist()
+        self.assertEqual('mimetype', infos[0].filename)
+        self.assertEqual(ZIP_STORED, infos[0].compress_type)
+        compress_types = {info.filename: info.compress_type for info in infos}
+        self.assertEqual(ZIP_STORED, compress_types['OEBPS/style.css'])
+        # Stored in the source, the policy requires it to be deflated
+        self.assertEqual(ZIP_DEFLATED, compress_types['OEBPS/image.png'])
+        self.assertEqual(ZIP_DEFLATED, compress_types['OEBPS/font.ttf'])
+
+    def test_save_in_parallel_keeps_order(self) -> None:
+        for i in range(20):
+            self.container.write(f'OEBPS/page{i}.xhtml', bytes(i) * 1000)
+
+        self.container.save(self.test_dir / 'serial.epub', workers=1)
+        self.container.save(self.test_dir / 'parallel.epub', workers=4)
+
+        with ZipFile(self.test_dir / 'serial.epub') as serial,\
+                ZipFile(self.test_dir / 'parallel.epub') as parallel:
+            self.assertIsNone(parallel.testzip())
+            self.assertListEqual(serial.namelist(), parallel.namelist())
+            for name in serial.namelist():
+                self.assertEqual(serial.read(name), parallel.read(name))
+
+    def test_changes_after_snapshot_stay_modified(self) -> None:
+        self.container.write('OEBPS/style.css', b'p {}')
+        snapshot = self.container.snapshot()
+        self.container.write('OEBPS/style.css', b'h1 {}')
+        self.container.remove('OEBPS/image.png')
+
+        temp_path = snapshot.write(self.book_path)
+        self.container.finish_save(snapshot, temp_path, self.book_path)
+
+        with ZipFile(self.book_path) as book:
+            self.assertEqual(b'p {}', book.read('OEBPS/style.css'))
+            self.assertIn('OEBPS/image.png', book.namelist())
+        self.assertTrue(self.container.is_modified('OEBPS/style.css'))
+        self.assertEqual(b'h1 {}', self.container.read('OEBPS/style.css'))
+        self.assertFalse(self.container.exists('OEBPS/image.png'))
+
+    def test_save_reports_progress(self) -> None:
+        calls = []
+        self.container.save(self.test_dir / 'saved.epub',
+                            progress=lambda *args: calls.append(args))
+
+        self.assertEqual(3, len(calls))
+        self.assertEqual((calls[-1][1], calls[-1][1], 3, 3), calls[-1])
+        self.assertListEqual(['book.epub', 'edit', 'saved.epub'],
+                             sorted(path.name
+                                    for path in self.test_dir.iterdir()))
+
+    def test_failed_save_keeps_target(self) -> None:
+        snapshot = self.container.snapshot()
+        # Member with unsupported compression fails while being written
+        broken_info = copy(snapshot.members[-1][1])
+        broken_info.compress_type = 99
+        snapshot.members.append(('broken', broken_info, None))
+
+        with self.assertRaises(Exception):
+            snapshot.write(self.book_path)
+
+        self.assertListEqual(['book.epub', 'edit'],
+                             sorted(path.name
+                                    for path in self.test_dir.iterdir()))
+        with ZipFile(self.book_path) as book:
+            self.assertIsNone(book.testzip())
+
+    def test_failed_finish_save_removes_temp_file(self) -> None:
+        target = self.test_dir / 'target.epub'
+        target.mkdir()
+        snapshot = self.container.snapshot()
+        temp_path = snapshot.write(target)
+
+        with self.assertRaises(OSError):
+            self.container.finish_save(snapshot, temp_path, target)
+
+        self.assertListEqual(['book.epub', 'edit', 'target.epub'],
+                             sorted(path.name
+                                    for path in self.test_dir.iterdir()))
+
+    def test_resolve_href(self) -> None:
+        self.assertEqual('OEBPS/css/a%b.css',
+                         resolve_href('OEBPS/page.xhtml', 'css/a%25b.css'))
+        self.assertEqual('img.png',
+                         resolve_href('OEBPS/page.xhtml', '../img.png#x'))
+        self.assertIsNone(resolve_href('OEBPS/page.xhtml', 'http://a.b/c'))
+        self.assertIsNone(resolve_href('OEBPS/page.xhtml', '#anchor'))
+        self.assertIsNone(resolve_href('page.xhtml', '../img.png'))
@@ -1,13 +1,23 @@
 import unittest
+import shutil
+import tempfile
+import cssutils
 from file_manager import FileManager
+from font import Font
 import os
 from pathlib import Path
 
 
 class TestFileManager(unittest.TestCase):
 
+    def setUp(self) -> None:
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.cache_dir)
+
     def test_prepare_edition_dir_no_dir_at_start(self) -> None:
-        test_file_manager = FileManager()  # executes .prepare_edition_dir
+        test_file_manager = FileManager(cache_dir=self.cache_dir)  # executes .prepare_edition_dir
 
         is_dir = Path(test_file_manager.edition_dir).is_dir()
         dir_content_list = os.listdir(test_file_manager.edition_dir)
@@ -17,7 +27,7 @@ class TestFileManager(unittest.TestCase):
         self.assertEqual(dir_content_list, [])
 
     def test_prepare_edition_dir_empty_dir_at_start(self) -> None:
-        test_file_manager = FileManager()
+        test_file_manager = FileManager(cache_dir=self.cache_dir)
         test_file_manager.prepare_edition_dir()
 
         is_dir = Path(test_file_manager.edition_dir).is_dir()
@@ -28,7 +38,7 @@ class TestFileManager(unittest.TestCase):
         self.assertEqual(dir_content_list, [])
 
     def test_prepare_edition_dir_dir_with_files_at_start(self) -> None:
-        test_file_manager = FileManager()
+        test_file_manager = FileManager(cache_dir=self.cache_dir)
         with open(Path(test_file_manager.edition_dir) / 'file',
                   'w') as file:
             file.write('dawqa')
@@ -42,7 +52,7 @@ class TestFileManager(unittest.TestCase):
         self.assertEqual(dir_content_list, [])
 
     def test_prepare_edition_dir_dir_with_subdirs_at_start(self) -> None:
-        test_file_manager = FileManager()
+        test_file_manager = FileManager(cache_dir=self.cache_dir)
         os.mkdir(Path(test_file_manager.edition_dir) / 'dir')
         with open(Path(test_file_manager.edition_dir) / 'dir' / 'file',
                   'w') as file:
@@ -55,3 +65,182 @@ class TestFileManager(unittest.TestCase):
 
         self.assertTrue(is_dir)
         self.assertEqual(dir_content_list, [])
+
+    def test_open_book_defers_stylesheets(self) -> None:
+        test_file_manager = FileManager(cache_dir=self.cache_dir)
+        result = test_file_manager.open_book(Path('books/manual.epub'))
+        opened_css_count = test_file_manager.get_css_file_count()
+        page_count = test_file_manager.get_page_count()
+        test_file_manager.load_css_files()
+        loaded_css_count = test_file_manager.get_css_file_count()
+        test_file_manager.container.close()
+        test_file_manager.prepare_edition_dir()
+        os.rmdir(test_file_manager.edition_dir)
+
+        self.assertEqual(0, result)
+        self.assertEqual(0, opened_css_count)
+        self.assertGreater(page_count, 0)
+        self.assertEqual(len(test_file_manager.css_file_paths),
+                         loaded_css_count)
+
+    def test_get_css_rule_text(self) -> None:
+        test_file_manager = FileManager(cache_dir=self.cache_dir)
+        test_file_manager.load_book(Path('books/manual.epub'))
+        style_name = test_file_manager.get_css_style_names()[0]
+        test_file_manager.set_css_param(style_name, 'color', 'red')
+
+        css_file_path, selector, declarations = \
+            test_file_manager.get_css_rule_text(style_name)
+        missing = test_file_manager.get_css_rule_text('no-such-style')
+        rules_changed = test_file_manager.css_rules_changed
+        test_file_manager.container.close()
+        test_file_manager.prepare_edition_dir()
+        os.rmdir(test_file_manager.edition_dir)
+
+        self.assertEqual(test_file_manager.container.member_name(
+            test_file_manager.css_file_paths[0]), css_file_path)
+        self.assertEqual(style_name, selector)
+        self.assertIn('color: red', declarations)
+        self.assertIsNone(missing)
+        self.assertFalse(rules_changed)
+
+    def test_get_member_data_serves_unsaved_css(self) -> None:
+        test_file_manager = FileManager(cache_dir=self.cache_dir)
+        test_file_manager.load_book(Path('books/manual.epub'))
+        style_name = test_file_manager.get_css_style_names()[0]
+        test_file_manager.set_css_param(style_name, 'color', 'red')
+        css_name = test_file_manager.container.member_name(
+            test_file_manager.css_file_paths[0])
+
+        css_data, css_media_type = test_file_manager.get_member_data(css_name)
+        written = test_file_manager.container.is_modified(css_name)
+        _, page_name = test_file_manager.get_page(0)
+        page_data, page_media_type = \
+            test_file_manager.get_member_data(page_name)
+        missing = test_file_manager.get_member_data('no/such/file.css')
+        test_file_manager.container.close()
+        test_file_manager.prepare_edition_dir()
+        os.rmdir(test_file_manager.edition_dir)
+
+        self.assertIn(b'color: red', css_data)
+        self.assertEqual('text/css', css_media_type)
+        self.assertFalse(written)
+        self.assertGreater(len(page_data), 0)
+        self.assertEqual('application/xhtml+xml', page_media_type)
+        self.assertIsNone(missing)
+
+    def test_update_css_writes_only_dirty_files(self) -> None:
+        test_file_manager = FileManager(cache_dir=self.cache_dir)
+        test_file_manager.load_book(Path('books/manual.epub'))
+        style_name = test_file_manager.get_css_style_names()[0]
+
+        unchanged = test_file_manager.update_css()
+        test_file_manager.set_css_param(style_name, 'color', 'red')
+        changed = test_file_manager.update_css()
+        changed_again = test_file_manager.update_css()
+        test_file_manager.container.close()
+        test_file_manager.prepare_edition_dir()
+        os.rmdir(test_file_manager.edition_dir)
+
+        self.assertListEqual([], unchanged)
+        self.assertListEqual(test_file_manager.css_file_paths[:1], changed)
+        self.assertListEqual([], changed_again)
+
+    def test_save_book_onto_directory_fails(self) -> None:
+        test_file_manager = FileManager(cache_dir=self.cache_dir)
+        test_file_manager.load_book(Path('books/manual.epub'))
+        save_dir = tempfile.mkdtemp()
+        target = Path(save_dir) / 'target.epub'
+        target.mkdir()
+
+        result = test_file_manager.save_book(target)
+        saved_files = os.listdir(save_dir)
+        shutil.rmtree(save_dir)
+        test_file_manager.container.close()
+        test_file_manager.prepare_edition_dir()
+        os.rmdir(test_file_manager.edition_dir)
+
+        self.assertEqual(1, result)
+        self.assertListEqual(['target.epub'], saved_files)
+
+    def test_style_index_duplicated_selectors(self) -> None:
+        test_file_manager = FileManager(cache_dir=self.cache_dir)
+        os.rmdir(test_file_manager.edition_dir)
+        test_file_manager.css_files = [
+            cssutils.parseString('p { color: red } h1 { color: blue }'),
+            cssutils.parseString('p { margin: 0 }')]
+        test_file_manager.build_css_indexes()
+
+        rules = test_file_manager.get_css_rules_by_name('p')
+        file_index, _ = test_file_manager.get_css_rule_by_name('p')
+
+        self.assertListEqual([0, 1], [index for index, _ in rules])
+        self.assertEqual(0, file_index)
+        self.assertEqual('red', test_file_manager.get_css_param('p', 'color'))
+        self.assertEqual('', test_file_manager.get_css_param('div', 'color'))
+
+    def test_font_usage_follows_edits(self) -> None:
+        test_file_manager = FileManager(cache_dir=self.cache_dir)
+        os.rmdir(test_file_manager.edition_dir)
+        test_file_manager.css_files = [
+            cssutils.parseString('p { font-family: Signika, sans-serif } '
+                                 'h1 { font-family: Signika }'),
+            cssutils.parseString('@font-face { font-family: Pacifico } '
+                                 'h2 { color: red }')]
+        test_file_manager.build_css_indexes()
+        used_at_start = test_file_manager.get_used_font_name_list()
+
+        test_file_manager.set_css_param('p', 'font-family', 'Pacifico, cursive')
+        test_file_manager.set_css_param('h2', 'font-family', 'Pacifico')
+        used_after_set = test_file_manager.get_used_font_name_list()
+        test_file_manager.remove_css_param('h1', 'font-family')
+
+        self.assertListEqual(['Signika'], used_at_start)
+        self.assertListEqual(['Signika', 'Pacifico'], used_after_set)
+        self.assertDictEqual({'Pacifico': 2}, test_file_manager.font_usage)
+        self.assertListEqual(['Pacifico'], test_file_manager.get_css_font_name_list())
+
+    def test_font_family_names_are_quoted(self) -> None:
+        test_file_manager = FileManager(cache_dir=self.cache_dir)
+        os.rmdir(test_file_manager.edition_dir)
+        test_file_manager.css_file_paths = [test_file_manager.edition_dir / 'a.css']
+        test_file_manager.css_files = [cssutils.parseString('p { color: red }')]
+        test_file_manager.build_css_indexes()
+        font = Font('fonts/Press_Start_2P/PressStart2P-Regular.ttf', Font.TYPE_LOCAL_FILE)
+        font.name = 'Press Start 2P'
+
+        test_file_manager.set_css_param('p', 'font-family', font.get_css_string())
+        test_file_manager.add_css_font_property(
+            font, test_file_manager.edition_dir / 'fonts' / 'PressStart2P-Regular.ttf')
+
+        self.assertEqual('"Press Start 2P", sans-serif',
+                         test_file_manager.get_css_param('p', 'font-family'))
+        self.assertListEqual(['Press Start 2P'], test_file_manager.get_used_font_name_list())
+        self.assertListEqual(['Press Start 2P'], test_file_manager.get_css_font_name_list())
+        self.assertIn(b'font-family: "Press Start 2P"', test_file_manager.css_files[0].cssText)
+
+    def test_overwrite_css_file_with_text_reloads_only_that_file(self) -> None:
+        test_file_manager = FileManager(cache_dir=self.cache_dir)
+        test_file_manager.css_file_paths = [
+            test_file_manager.edition_dir / 'a.css',
+            test_file_manager.edition_dir / 'b.css']
+        test_file_manager.css_files = [
+            cssutils.parseString('p { color: red } h1 { color: blue }'),
+            cssutils.parseString('p { margin: 0 }')]
+        test_file_manager.build_css_indexes()
+        untouched_file = test_file_manager.css_files[0]
+
+        test_file_manager.overwrite_css_file_with_text(
+            test_file_manager.css_file_paths[1], 'h1 { margin: 0 } p { }')
+        with open(test_file_manager.css_file_paths[1]) as file:
+            written = file.read()
+        test_file_manager.prepare_edition_dir()
+        os.rmdir(test_file_manager.edition_dir)
+
+        self.assertEqual('h1 { margin: 0 } p { }', written)
+        self.assertIs(untouched_file, test_file_manager.css_files[0])
+        self.assertListEqual(
+            [0, 1], [i for i, _ in test_file_manager.get_css_rules_by_name('h1')])
+        self.assertListEqual(
+            [0, 1], [i for i, _ in test_file_manager.get_css_rules_by_name('p')])
+        self.assertEqual('0', test_file_manager.get_css_rules_by_name('h1')[1][1].style.margin)
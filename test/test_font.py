@@ -0,0 +1,69 @@
+import unittest
+from font import Font, FontRegistry
+
+
+class TestFont(unittest.TestCase):
+
+    def test_quote_family(self) -> None:
+        self.assertEqual('"Press Start 2P"', Font.quote_family('Press Start 2P'))
+        self.assertEqual('"A \\"B\\""', Font.quote_family('A "B"'))
+        self.assertEqual('A "B"', Font.unquote_family(Font.quote_family('A "B"')))
+        self.assertEqual('Arial', Font.unquote_family(" 'Arial' "))
+        self.assertEqual('Arial', Font.unquote_family('Arial'))
+
+    def test_get_font_from_css_string(self) -> None:
+        font = Font.get_font_from_css_string('"Press Start 2P", cursive')
+        self.assertEqual('Press Start 2P', font.name)
+        self.assertEqual('cursive', font.fallback)
+        self.assertEqual('"Press Start 2P", cursive', font.get_css_string())
+        self.assertEqual('"Arial"', Font('Arial', fallback=' ').get_css_string())
+
+
+class TestFontRegistry(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.registry = FontRegistry()
+        self.added = []
+        self.registry.add_listener(self.added.append)
+        self.registry.add_fonts([
+            Font('Times New Roman', Font.TYPE_NO_FILE, fallback='serif'),
+            Font('Arial', Font.TYPE_NO_FILE, fallback='sans-serif'),
+            Font('fonts/Signika/Signika-Regular.ttf', Font.TYPE_LOCAL_FILE)])
+
+    def test_font_has_slots(self) -> None:
+        with self.assertRaises(AttributeError):
+            Font('Arial').size = 12
+
+    def test_add_fonts_notifies_once(self) -> None:
+        self.assertEqual(1, len(self.added))
+        self.assertEqual(3, len(self.added[0]))
+        self.assertListEqual(sorted(self.registry.get_descriptions()),
+                             self.registry.get_descriptions())
+
+    def test_add_skips_registered(self) -> None:
+        added = self.registry.add_fonts([
+            Font('Arial', Font.TYPE_NO_FILE, fallback='sans-serif'),
+            Font('"arial"', Font.TYPE_FROM_EPUB, fallback='sans-serif'),
+            Font('Georgia', Font.TYPE_FROM_EPUB, fallback='serif')],
+            unique_name=True)
+
+        self.assertListEqual(['Georgia'], [font.name for font in added])
+        self.assertEqual(4, len(self.registry))
+        self.assertEqual(2, len(self.added))
+        self.assertFalse(self.registry.add(Font('Georgia', Font.TYPE_FROM_EPUB, fallback='serif')))
+        self.assertEqual(2, len(self.added))
+
+    def test_get_by_name(self) -> None:
+        self.assertEqual('Arial', self.registry.get_by_name('Arial').name)
+        self.assertEqual('Times New Roman',
+                         self.registry.get_by_name("'times  new roman'").name)
+        self.assertEqual('Signika-Regular',
+                         self.registry.get_by_name('Signika-Regular').name)
+        self.assertIsNone(self.registry.get_by_name('Verdana'))
+
+    def test_get_by_desc(self) -> None:
+        arial = self.registry.get_by_name('Arial')
+
+        self.assertIs(arial, self.registry.get_by_desc(str(arial)))
+        self.assertIs(arial, self.registry.get_by_desc(' [Basic] Ar'))
+        self.assertIsNone(self.registry.get_by_desc('[EPUB]'))
@@ -0,0 +1,86 @@
+import os
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import font_catalogue
+from font_catalogue import FontCatalogue, read_font_metadata
+
+FONTS_DIR = Path(__file__).parent.parent / 'fonts'
+
+
+class TestFontCatalogue(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.dir = tempfile.mkdtemp()
+        self.fonts_dir = Path(self.dir) / 'fonts'
+        os.makedirs(self.fonts_dir / 'Fira_Code')
+        shutil.copy(FONTS_DIR / 'Fira_Code/static/FiraCode-Bold.ttf',
+                    self.fonts_dir / 'Fira_Code')
+        shutil.copy(FONTS_DIR / 'Indie_Flower/IndieFlower-Regular.ttf',
+                    self.fonts_dir)
+        self.cache_path = Path(self.dir) / 'cache' / 'fonts.json'
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.dir)
+
+    def scan(self, check_files=True):
+        with mock.patch.object(font_catalogue, 'read_font_metadata',
+                               wraps=read_font_metadata) as read:
+            fonts = FontCatalogue(self.fonts_dir, self.cache_path)\
+                .scan(check_files)
+        return sorted(font.name for font in fonts), read.call_count
+
+    def test_read_font_metadata(self) -> None:
+        metadata = read_font_metadata(
+            FONTS_DIR / 'Fira_Code/static/FiraCode-Bold.ttf')
+        self.assertEqual('Fira Code', metadata['family'])
+        self.assertEqual('Bold', metadata['style'])
+        self.assertEqual(700, metadata['weight'])
+        self.assertEqual('monospace', metadata['fallback'])
+
+    def test_variable_font_is_named_apart(self) -> None:
+        shutil.copy(FONTS_DIR / 'Fira_Code/FiraCode-VariableFont_wght.ttf',
+                    self.fonts_dir / 'Fira_Code')
+        shutil.copy(FONTS_DIR / 'Fira_Code/static/FiraCode-Regular.ttf',
+                    self.fonts_dir / 'Fira_Code')
+
+        names, _ = self.scan()
+
+        self.assertListEqual(['Fira Code', 'Fira Code Bold',
+                              'Fira Code Variable', 'Indie Flower'], names)
+
+    def test_read_font_metadata_invalid(self) -> None:
+        path = self.fonts_dir / 'broken.ttf'
+        path.write_bytes(b'not a font')
+        with self.assertRaises(ValueError):
+            read_font_metadata(path)
+
+    def test_rescan_reads_only_new_fonts(self) -> None:
+        names, reads = self.scan()
+        self.assertListEqual(['Fira Code Bold', 'Indie Flower'], names)
+        self.assertEqual(2, reads)
+
+        self.assertEqual((names, 0), self.scan())
+        self.assertEqual((names, 0), self.scan(check_files=False))
+
+        shutil.copy(FONTS_DIR / 'Pacifico/Pacifico-Regular.ttf',
+                    self.fonts_dir / 'Fira_Code')
+        (self.fonts_dir / 'IndieFlower-Regular.ttf').unlink()
+        names, reads = self.scan(check_files=False)
+        self.assertListEqual(['Fira Code Bold', 'Pacifico'], names)
+        self.assertEqual(1, reads)
+
+    def test_scan_missing_fonts_dir(self) -> None:
+        self.scan()
+        shutil.rmtree(self.fonts_dir)
+
+        self.assertEqual(([], 0), self.scan(check_files=False))
+        self.assertDictEqual({}, FontCatalogue(self.fonts_dir,
+                                               self.cache_path).dirs)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,7 +2,9 @@ import unittest
 import os
 from pathlib import Path
 import shutil
-from pathfinder import MissingValueError, Pathfinder
+import tempfile
+from lxml import etree
+from pathfinder import Manifest, MissingValueError, Pathfinder
 
 
 class TestPathfinder(unittest.TestCase):
@@ -17,9 +19,9 @@ class TestPathfinder(unittest.TestCase):
             shutil.rmtree(test_dir)
 
         test_file_name = 'file'
-        written_content = 'abcdefg'
+        written_content = b'abcdefg'
         os.mkdir(test_dir)
-        with open(test_dir / test_file_name, 'w') as file:
+        with open(test_dir / test_file_name, 'wb') as file:
             file.write(written_content)
 
         self.test_pathfinder.set_book_dir(test_dir)
@@ -69,6 +71,17 @@ class TestPathfinder(unittest.TestCase):
         with self.assertRaises(FileNotFoundError):
             self.test_pathfinder.load_rendition(1)
 
+    def test_media_types_without_loaded_rendition(self) -> None:
+        self.test_pathfinder.set_book_dir(
+            self.test_dirs_dir / 'multiple_rootfiles;multiple_contents.opf')
+        self.test_pathfinder.find_renditions()
+
+        self.assertIsNone(self.test_pathfinder.get_media_type('OEBPS/epub-editor-logo.png'))
+        self.assertDictEqual({}, self.test_pathfinder.get_rendition_media_types())
+        self.assertDictEqual({}, self.test_pathfinder._opf_cache)
+        with self.assertRaises(IndexError):
+            self.test_pathfinder._get_manifest(-1)
+
     def test_find_renditions_multiple_rootfiles_multiple_contents_opf(self)\
             -> None:
         test_dir = self.test_dirs_dir /\
@@ -143,3 +156,121 @@ class TestPathfinder(unittest.TestCase):
         self.assertEqual(expected_opf_file_path, opf_file_path)
         self.assertListEqual(expected_spines, spines)
         self.assertListEqual(expected_stylesheets, stylesheets)
+
+    def test_opf_files_are_parsed_once(self) -> None:
+        test_dir = Path(tempfile.mkdtemp()) / 'book'
+        shutil.copytree(self.test_dirs_dir /
+                        'multiple_rootfiles;multiple_contents.opf', test_dir)
+        read_names = []
+        self.test_pathfinder.set_book_dir(test_dir)
+        self.test_pathfinder.find_renditions()
+        read = self.test_pathfinder._read
+        self.test_pathfinder._read =\
+            lambda name: read_names.append(name) or read(name)
+
+        self.test_pathfinder.load_rendition(0)
+        removed = self.test_pathfinder.remove_item_from_rendition_manifest(
+            ('logo', test_dir / 'OEBPS/epub-editor-logo.png'))
+        removed_again = self.test_pathfinder.remove_item_from_rendition_manifest(
+            ('logo', test_dir / 'OEBPS/epub-editor-logo.png'))
+        is_dirty = self.test_pathfinder.is_rendition_file_dirty()
+        self.test_pathfinder.load_rendition(1)
+        self.test_pathfinder.load_rendition(0)
+        items = self.test_pathfinder.get_rendition_manifest_items_attributes(0)
+
+        shutil.rmtree(test_dir.parent)
+        self.assertListEqual(['OEBPS/content1.opf', 'OEBPS/content2.opf'],
+                             read_names)
+        self.assertEqual((True, False), removed)
+        self.assertEqual((False, False), removed_again)
+        self.assertTrue(is_dirty)
+        self.assertFalse(self.test_pathfinder.is_rendition_file_dirty(0))
+        self.assertNotIn('logo', [item[0] for item in items])
+
+    def test_save_rendition_file_only_if_edited(self) -> None:
+        test_dir = Path(tempfile.mkdtemp()) / 'book'
+        shutil.copytree(self.test_dirs_dir / 'single_rootfile', test_dir)
+        self.test_pathfinder.set_book_dir(test_dir)
+        self.test_pathfinder.find_renditions()
+        self.test_pathfinder.load_rendition()
+        container = self.test_pathfinder.container
+
+        self.test_pathfinder.save_rendition_file()
+        written_unchanged = container.is_modified('OEBPS/content.opf')
+        self.test_pathfinder.add_item_to_rendition_manifest(
+            ['font', test_dir / 'OEBPS/Fonts/font.ttf', 'font/ttf'])
+        self.test_pathfinder.save_rendition_file()
+        written_changed = container.is_modified('OEBPS/content.opf')
+        content = container.read('OEBPS/content.opf')
+
+        shutil.rmtree(test_dir.parent)
+        self.assertFalse(written_unchanged)
+        self.assertTrue(written_changed)
+        self.assertIn(b'Fonts/font.ttf', content)
+        self.assertIn(b'dcterms:modified', content)
+        self.assertFalse(self.test_pathfinder.is_rendition_file_dirty())
+
+    def test_add_existing_item_keeps_rendition_file_clean(self) -> None:
+        self.test_pathfinder.set_book_dir(self.test_dirs_dir / 'single_rootfile')
+        self.test_pathfinder.find_renditions()
+        self.test_pathfinder.load_rendition()
+
+        results = self.test_pathfinder.add_items_to_rendition_manifest(
+            [['css', self.test_dirs_dir / 'single_rootfile/OEBPS/css/styles.css',
+              'text/css']])
+
+        self.assertListEqual([False], results)
+        self.assertFalse(self.test_pathfinder.is_rendition_file_dirty())
+
+
+class TestManifest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.element = etree.fromstring(
+            '<manifest xmlns="http://www.idpf.org/2007/opf">\n'
+            '  <item id="a" href="a.xhtml" media-type="application/xhtml+xml"/>\n'
+            '  <item id="img" href="1.png" media-type="image/png"/>\n'
+            '</manifest>')
+        self.manifest = Manifest(self.element)
+
+    def test_hrefs_are_resolved(self) -> None:
+        element = etree.fromstring(
+            '<manifest xmlns="http://www.idpf.org/2007/opf">\n'
+            '  <item id="css" href="./css/a%20b.css" media-type="text/css"/>\n'
+            '  <item id="font" href="../Fonts/f.ttf" media-type="font/ttf"/>\n'
+            '</manifest>')
+        manifest = Manifest(element, 'OEBPS/content.opf')
+
+        self.assertEqual('css', manifest.get_by_name('OEBPS/css/a b.css').get('id'))
+        self.assertEqual('css', manifest.get_by_href('css/a b.css').get('id'))
+        self.assertEqual('font', manifest.get_by_name('Fonts/f.ttf').get('id'))
+        self.assertListEqual([None], manifest.add_items([('css', 'css/a b.css', 'text/css')]))
+
+    def test_generate_id(self) -> None:
+        self.assertEqual('b', self.manifest.generate_id('b'))
+        self.assertEqual('img_1', self.manifest.generate_id('img'))
+        self.assertEqual('img_2', self.manifest.generate_id('img'))
+
+    def test_add_items(self) -> None:
+        added = self.manifest.add_items([('img', '2.png', 'image/png'),
+                                         ('img', '3.png', 'image/png'),
+                                         ('other', '1.png', 'image/png')])
+
+        self.assertListEqual(['img_1', 'img_2'],
+                             [item.get('id') for item in added[:2]])
+        self.assertIsNone(added[2])
+        self.assertEqual(4, len(self.manifest))
+        self.assertIs(added[1], self.manifest.get_by_href('3.png'))
+        self.assertEqual(3, len(self.manifest.get_by_media_type('image/png')))
+        self.assertListEqual(list(self.manifest), list(self.element))
+        self.assertEqual('\n', self.element[-1].tail)
+        self.assertEqual('\n  ', self.element[-2].tail)
+
+    def test_remove_items(self) -> None:
+        self.manifest.remove_items([self.manifest.get_by_id('img'),
+                                    self.manifest.get_by_id('a')])
+
+        self.assertEqual(0, len(self.manifest))
+        self.assertEqual(0, len(self.element))
+        self.assertIsNone(self.manifest.get_by_href('1.png'))
+        self.assertListEqual([], self.manifest.get_by_media_type('image/png'))
@@ -0,0 +1,53 @@
+import unittest
+from PySide6.QtCore import QCoreApplication, QTimer
+from preview import RefreshScheduler, build_highlight_script, \
+    build_rule_update_script
+
+
+class TestRefreshScheduler(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.app = QCoreApplication.instance() or QCoreApplication([])
+
+    def run_events(self, milliseconds) -> None:
+        QTimer.singleShot(milliseconds, self.app.quit)
+        self.app.exec()
+
+    def test_schedule_merges_requests(self) -> None:
+        calls = []
+        scheduler = RefreshScheduler(lambda: calls.append(1), interval=5)
+        for _ in range(10):
+            scheduler.schedule()
+        self.run_events(50)
+
+        self.assertEqual(1, len(calls))
+        self.assertFalse(scheduler.timer.isActive())
+
+    def test_flush_and_cancel(self) -> None:
+        calls = []
+        scheduler = RefreshScheduler(lambda: calls.append(1), interval=5)
+        scheduler.schedule()
+        scheduler.flush()
+        scheduler.flush()
+        scheduler.schedule()
+        scheduler.cancel()
+        self.run_events(50)
+
+        self.assertEqual(1, len(calls))
+
+    def test_build_rule_update_script_escapes_arguments(self) -> None:
+        script = build_rule_update_script('OEBPS/a b.css', 'p[title="x"]',
+                                          'content: "\\n"')
+
+        self.assertIn('"epub:/OEBPS/a%20b.css"', script)
+        self.assertIn('"p[title=\\"x\\"]"', script)
+        self.assertIn('"content: \\"\\\\n\\""', script)
+
+    def test_build_highlight_script(self) -> None:
+        script = build_highlight_script('h1', '#ffffab')
+        removing_script = build_highlight_script('', '#ffffab')
+
+        self.assertIn('"h1 { background-color: #ffffab !important; }"',
+                      script)
+        self.assertTrue(removing_script.endswith('("")'))
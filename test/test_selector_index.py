@@ -0,0 +1,40 @@
+import unittest
+from selector_index import SelectorIndex
+
+PAGES = [
+    b'<html xmlns="http://www.w3.org/1999/xhtml"><body>'
+    b'<p class="note">a</p><p>b</p></body></html>',
+    b'<html xmlns="http://www.w3.org/1999/xhtml"><body><h1>c</h1></body></html>',
+    b'not a page',
+    b'<html xmlns="http://www.w3.org/1999/xhtml"><body>'
+    b'<p class="note">d</p></body></html>',
+]
+
+
+@unittest.skipUnless(SelectorIndex.is_available(), 'cssselect is not installed')
+class TestSelectorIndex(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.index = SelectorIndex.from_documents(PAGES)
+        self.index.update(['p', 'p.note', 'h1, h2', 'p[', 'p::first-line'])
+
+    def test_match_count(self) -> None:
+        self.assertEqual((3, 2), self.index.get_match_count('p'))
+        self.assertEqual((2, 2), self.index.get_match_count('p.note'))
+        self.assertEqual((1, 1), self.index.get_match_count('h1, h2'))
+        self.assertEqual((3, 2), self.index.get_match_count('p::first-line'))
+        self.assertIsNone(self.index.get_match_count('p['))
+        self.assertIsNone(self.index.get_match_count('span'))
+
+    def test_get_next_page_wraps(self) -> None:
+        self.assertEqual(3, self.index.get_next_page('p.note', 0))
+        self.assertEqual(0, self.index.get_next_page('p.note', 3))
+        self.assertEqual(1, self.index.get_next_page('h1, h2', 1))
+
+    def test_update_matches_only_new_selectors(self) -> None:
+        counts = self.index.matches['p']
+        self.index.update(['p', 'span'])
+
+        self.assertIs(counts, self.index.matches['p'])
+        self.assertEqual((0, 0), self.index.get_match_count('span'))
+        self.assertNotIn('p.note', self.index.matches)
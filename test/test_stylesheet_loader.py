@@ -0,0 +1,81 @@
+import unittest
+import os
+import pickle
+import shutil
+import tempfile
+from pathlib import Path
+from unittest.mock import patch
+from stylesheet_loader import StylesheetCache, parse_stylesheets
+
+
+class TestStylesheetLoader(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.sources = [
+            (b'p { color: red } @media print { p { margin: 0 } }', 'a.css'),
+            (b'@font-face { font-family: x; src: url(x.ttf) }', 'b.css'),
+            (b'h1 { font-size: 2em }', 'c.css')]
+
+    def test_parse_stylesheets_serial(self) -> None:
+        sheets = parse_stylesheets(self.sources)
+
+        self.assertListEqual(['a.css', 'b.css', 'c.css'],
+                             [sheet.href for sheet in sheets])
+
+    def test_parse_stylesheets_parallel(self) -> None:
+        expected = [sheet.cssText for sheet in parse_stylesheets(self.sources)]
+
+        sheets = parse_stylesheets(self.sources, min_parallel_size=0)
+
+        self.assertListEqual(expected, [sheet.cssText for sheet in sheets])
+        rule = sheets[0].cssRules[0]
+        self.assertIs(sheets[0], rule.parentStyleSheet)
+        rule.style.setProperty('color', 'blue')
+        self.assertEqual('blue', rule.style.getPropertyValue('color'))
+
+    def test_pickled_stylesheet_can_be_edited(self) -> None:
+        sheet = pickle.loads(pickle.dumps(parse_stylesheets(self.sources)[0]))
+
+        sheet.deleteRule(0)
+        sheet.insertRule('div { color: red }', 0)
+
+        self.assertEqual(2, len(sheet.cssRules))
+
+
+class TestStylesheetCache(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.cache_dir = Path(tempfile.mkdtemp())
+        self.cache = StylesheetCache(self.cache_dir)
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.cache_dir)
+
+    def test_cached_stylesheet_is_not_parsed(self) -> None:
+        sources = [(b'p { color: red }', 'a.css')]
+        parse_stylesheets(sources, cache=self.cache)
+
+        with patch('stylesheet_loader.parse_stylesheet') as parse:
+            sheets = parse_stylesheets([(b'p { color: red }', 'b.css')],
+                                       cache=self.cache)
+
+        parse.assert_not_called()
+        self.assertEqual('b.css', sheets[0].href)
+        self.assertEqual('red', sheets[0].cssRules[0].style.color)
+
+    def test_least_recently_used_entries_are_evicted(self) -> None:
+        first = parse_stylesheets([(b'p { color: red }', None)])[0]
+        entry_size = len(pickle.dumps(first, pickle.HIGHEST_PROTOCOL))
+        self.cache.max_size = entry_size * 2
+        keys = [self.cache.get_key(bytes([i])) for i in range(3)]
+
+        self.cache.put(keys[0], pickle.dumps(first))
+        self.cache.put(keys[1], pickle.dumps(first))
+        os.utime(self.cache._get_path(keys[0]), (0, 0))
+        os.utime(self.cache._get_path(keys[1]), (1, 1))
+        self.assertIsNotNone(self.cache.get(keys[0]))  # Marks as used
+        self.cache.put(keys[2], pickle.dumps(first))
+
+        self.assertIsNotNone(self.cache.get(keys[0]))
+        self.assertIsNone(self.cache.get(keys[1]))
+        self.assertIsNotNone(self.cache.get(keys[2]))
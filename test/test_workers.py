@@ -0,0 +1,49 @@
+import unittest
+from unittest import mock
+from file_manager import FileManager
+import os
+import tempfile
+from workers import LoadThread
+
+
+class TestLoadThread(unittest.TestCase):
+
+    def test_signals_used_by_main_window_exist(self) -> None:
+        cache_dir = tempfile.mkdtemp()
+        file_manager = FileManager(cache_dir=cache_dir)
+        os.rmdir(file_manager.edition_dir)
+        os.rmdir(cache_dir)
+        load_thread = LoadThread(file_manager, 'books/manual.epub')
+        received = []
+
+        # The same signals MainWindow.file_open connects to
+        load_thread.book_opened.connect(received.append)
+        load_thread.stylesheets_loaded.connect(lambda: received.append(None))
+        load_thread.fonts_found.connect(received.append)
+        load_thread.selectors_indexed.connect(received.append)
+        load_thread.load_failed.connect(received.append)
+        load_thread.selectors_indexed.emit(None)
+
+        self.assertListEqual([None], received)
+
+    def test_failed_stylesheets_stop_loading(self) -> None:
+        cache_dir = tempfile.mkdtemp()
+        file_manager = FileManager(cache_dir=cache_dir)
+        load_thread = LoadThread(file_manager, 'books/manual.epub')
+        received = []
+        load_thread.stylesheets_loaded.connect(lambda: received.append('loaded'))
+        load_thread.selectors_indexed.connect(received.append)
+        load_thread.load_failed.connect(received.append)
+
+        with mock.patch.object(file_manager, 'load_css_files',
+                               side_effect=FileNotFoundError('style.css')):
+            load_thread.run()  # In this thread
+        file_manager.close_book()
+        os.rmdir(file_manager.edition_dir)
+        os.rmdir(cache_dir)
+
+        self.assertListEqual(['style.css'], received)
+
+
+if __name__ == '__main__':
+    unittest.main()
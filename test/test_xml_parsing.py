@@ -0,0 +1,34 @@
+import unittest
+import threading
+from lxml import etree
+from xml_parsing import get_xml_parser, parse_xml
+
+
+class TestXmlParsing(unittest.TestCase):
+
+    def test_parse_xml_uses_declared_encoding(self) -> None:
+        data = '<?xml version="1.0" encoding="ISO-8859-2"?><title>Żółw</title>'\
+            .encode('iso-8859-2')
+
+        tree = parse_xml(data)
+
+        self.assertEqual('Żółw', tree.getroot().text)
+
+    def test_parse_xml_invalid(self) -> None:
+        with self.assertRaises(etree.XMLSyntaxError):
+            parse_xml(b'<a><b></a>')
+        with self.assertRaises(etree.XMLSyntaxError):
+            parse_xml(b'not xml', recover=True)
+        self.assertEqual('a', parse_xml(b'<a><b></a>', recover=True)
+                         .getroot().tag)
+
+    def test_parser_is_cached_per_thread(self) -> None:
+        other_thread_parsers = []
+        thread = threading.Thread(
+            target=lambda: other_thread_parsers.append(get_xml_parser()))
+        thread.start()
+        thread.join()
+
+        self.assertIs(get_xml_parser(), get_xml_parser())
+        self.assertIsNot(get_xml_parser(), get_xml_parser(recover=True))
+        self.assertIsNot(get_xml_parser(), other_thread_parsers[0])
@@ -0,0 +1,70 @@
+from PySide6.QtCore import QThread, Signal
+
+
+class SaveThread(QThread):
+    """
+    Writes snapshot of the book into a temporary file next to `save_path`,
+    without blocking the interface. Result is kept in `temp_path` or `error`
+    once the thread finishes
+    """
+    # bytes written, bytes total, files written, files total
+    progress = Signal('qint64', 'qint64', int, int)
+
+    def __init__(self, snapshot, save_path, parent=None):
+        super().__init__(parent)
+        self.snapshot = snapshot
+        self.save_path = save_path
+        self.temp_path = None
+        self.error = None
+
+    def run(self):
+        try:
+            self.temp_path = self.snapshot.write(self.save_path, self.progress.emit)
+        except Exception as e:
+            self.error = e
+
+
+class LoadThread(QThread):
+    """
+    Loads the book in stages, signalling after each of them: structure of
+    the book (pages can be shown), stylesheets, names of fonts the book uses,
+    index of pages on which styles are used.\n
+    If stylesheets can not be loaded, `load_failed` is emitted instead of
+    the later signals. The index is optional, `None` is sent if it fails
+    """
+    book_opened = Signal(int)  # 0 if succeeded, or a positive number
+    stylesheets_loaded = Signal()
+    fonts_found = Signal(list)
+    selectors_indexed = Signal(object)  # SelectorIndex or None
+    load_failed = Signal(str)  # Error message
+
+    def __init__(self, file_manager, file_path, parent=None):
+        super().__init__(parent)
+        self.file_manager = file_manager
+        self.file_path = file_path
+
+    def run(self):
+        result = self.file_manager.open_book(self.file_path)
+        self.book_opened.emit(result)
+        if result > 0:
+            return
+
+        try:
+            self.file_manager.load_css_files()
+        except Exception as e:
+            print(f"Could not load stylesheets due to {e}")
+            self.load_failed.emit(str(e))
+            return
+        print('File loaded')
+        self.stylesheets_loaded.emit()
+
+        font_names = self.file_manager.get_css_font_name_list()
+        font_names.extend(self.file_manager.get_used_font_name_list())
+        self.fonts_found.emit(font_names)
+
+        try:
+            selector_index = self.file_manager.create_selector_index()
+        except Exception as e:
+            print(f"Could not index selectors due to {e}")
+            selector_index = None
+        self.selectors_indexed.emit(selector_index)
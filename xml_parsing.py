@@ -0,0 +1,39 @@
+"""
+Parsing of XML documents of the book (container.xml, OPF files, pages)
+straight from their bytes, so that lxml decodes them once, according to
+their own encoding declarations
+"""
+import threading
+
+from lxml import etree
+
+# lxml parsers can not be used by more than one thread at a time,
+# so every thread creates its own ones
+_parsers = threading.local()
+
+
+def get_xml_parser(recover: bool = False) -> etree.XMLParser:
+    """
+    Returns parser which neither resolves entities nor accesses network,
+    created once per thread. With `recover` it tries hard to parse
+    broken documents
+    """
+    parsers = getattr(_parsers, 'parsers', None)
+    if parsers is None:
+        parsers = _parsers.parsers = dict[bool, etree.XMLParser]()
+    if recover not in parsers:
+        parsers[recover] = etree.XMLParser(recover=recover,
+                                           resolve_entities=False,
+                                           no_network=True)
+    return parsers[recover]
+
+
+def parse_xml(data: bytes, recover: bool = False):
+    """
+    Returns tree of the document.
+    Raises `etree.XMLSyntaxError` if it is not valid (without `recover`)
+    """
+    root = etree.fromstring(data, get_xml_parser(recover))
+    if root is None:  # Nothing could be recovered
+        raise etree.XMLSyntaxError('Document is empty', None, 0, 0)
+    return root.getroottree()